@@ -0,0 +1 @@
+"""Benchmarks do backend (executar a partir do diretório backend/: python -m benchmarks.<nome>)"""
@@ -0,0 +1,295 @@
+"""Gerador de dados sintéticos em escala para testes de carga e planos de consulta
+
+Gera departamentos, gerentes, agentes, contatos, conversas, mensagens e
+transferências com distribuições realistas: tamanho das conversas em lei de
+potência (poucas conversas muito longas), horário comercial, conversas antigas
+quase sempre fechadas e no máximo uma conversa ativa por contato. Os dados são
+gravados com insert() do Core em executemany, em transações grandes e com os
+índices criados só no final, e os resumos das conversas (message_count,
+last_message_*) já saem preenchidos.
+
+    cd backend && python -m benchmarks.dataset --database /tmp/10m.db --messages 10000000
+    cd backend && DATABASE_URL=postgresql://... python -m benchmarks.dataset --messages 1000000
+"""
+import argparse
+import bisect
+import hashlib
+import itertools
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask
+from sqlalchemy import func, insert, select, text
+
+from src.models.user import db, User, Department, Conversation, Message, Transfer, PREVIEW_LENGTH
+from src.models.schema import ensure_indexes
+
+DEPARTMENT_NAMES = ['Suporte', 'Vendas', 'Marketing', 'Financeiro', 'Cobrança', 'Logística', 'Pós-venda', 'Ouvidoria']
+CUSTOMER_TEXTS = [
+    'Olá, preciso de ajuda', 'Meu pedido ainda não chegou', 'Qual o prazo de entrega?',
+    'Gostaria de cancelar', 'Obrigado!', 'Pode me enviar a segunda via do boleto?',
+    'O produto veio com defeito', 'Vocês têm em estoque?', 'Ok', 'Ainda estou aguardando retorno'
+]
+AGENT_TEXTS = [
+    'Olá! Como posso ajudar?', 'Vou verificar para você, um momento.', 'Pode me informar o número do pedido?',
+    'Pronto, já foi resolvido.', 'Encaminhei para o setor responsável.', 'Posso ajudar em algo mais?',
+    'O prazo é de 3 a 5 dias úteis.', 'Segue o link para acompanhamento.'
+]
+TRANSFER_REASONS = ['Assunto de outro setor', 'Cliente solicitou', 'Escalonamento', 'Negociação de valores']
+# Peso de cada hora do dia na abertura de conversas (pico no horário comercial)
+HOUR_WEIGHTS = [1, 1, 1, 1, 1, 2, 4, 8, 14, 18, 18, 16, 12, 14, 17, 17, 15, 12, 9, 7, 5, 4, 3, 2]
+# Fração das mensagens de agentes que o WhatsApp recusou
+FAILED_DELIVERY_RATE = 0.01
+
+
+def thread_lengths(rng, conversations, messages, alpha=1.2, max_share=0.01):
+    """Distribuir `messages` entre as conversas em lei de potência (Pareto), soma exata"""
+    weights = [rng.paretovariate(alpha) for _ in range(conversations)]
+    # Limitar a conversa mais longa a uma fração do total
+    cap = max(weights) if messages * max_share < 1 else sum(weights) * max_share
+    weights = [min(w, cap) for w in weights]
+    scale = (messages - conversations) / sum(weights)
+    lengths = [1 + int(w * scale) for w in weights]
+    # Distribuir o resto do arredondamento
+    for i in rng.sample(range(conversations), messages - sum(lengths)):
+        lengths[i] += 1
+    return lengths
+
+
+def delivery_status(rng):
+    """Situação de envio de uma mensagem antiga de agente (os valores de Message.delivery_status)"""
+    return 'failed' if rng.random() < FAILED_DELIVERY_RATE else 'sent'
+
+
+def next_id(connection, table):
+    return (connection.execute(select(func.max(table.c.id))).scalar() or 0) + 1
+
+
+def generate_dataset(engine, messages=1_000_000, conversations=100_000, contacts=None, departments=8,
+                     agents=200, days=365, transfer_rate=0.12, batch_size=50_000, seed=42, progress=print):
+    """Gravar um conjunto sintético; retorna a quantidade de linhas por tabela
+
+    Os ids continuam a partir dos já existentes, então pode ser usado num banco
+    com os dados iniciais do app.
+    """
+    rng = random.Random(seed)
+    contacts = contacts or max(1, int(conversations * 0.8))
+    end = datetime.utcnow().replace(microsecond=0)
+    start = end - timedelta(days=days)
+    # Mesmo esquema de User.set_password: todos os usuários gerados entram com senha123
+    password_hash = hashlib.sha256(b'senha123').hexdigest()
+    hours = list(itertools.accumulate(HOUR_WEIGHTS))
+    counts = {'departments': departments, 'users': 0, 'conversations': conversations, 'messages': 0, 'transfers': 0}
+    is_sqlite = engine.dialect.name == 'sqlite'
+
+    with engine.connect() as connection:
+        if is_sqlite:
+            # Carga em massa: sem fsync por transação e com cache grande
+            connection.exec_driver_sql('PRAGMA synchronous=OFF')
+            connection.exec_driver_sql('PRAGMA cache_size=-262144')
+            connection.exec_driver_sql('PRAGMA temp_store=MEMORY')
+
+        existing_names = set(connection.execute(select(Department.name)).scalars())
+        first_department = next_id(connection, Department.__table__)
+        department_ids = list(range(first_department, first_department + departments))
+        names = (DEPARTMENT_NAMES + [f'Departamento {i}' for i in range(1, departments + 1)])
+        names = [name for name in names if name not in existing_names][:departments]
+        connection.execute(insert(Department), [
+            {'id': department_id, 'name': name, 'description': f'Atendimento de {name}', 'is_active': True,
+             'created_at': start, 'updated_at': start}
+            for department_id, name in zip(department_ids, names)
+        ])
+
+        # Um gerente por departamento; agentes concentrados nos departamentos maiores
+        first_user = next_id(connection, User.__table__)
+        users = []
+        agents_by_department = {department_id: [] for department_id in department_ids}
+        department_weights = [1 / (i + 1) for i in range(departments)]
+        for i in range(departments + agents):
+            user_id = first_user + i
+            if i < departments:
+                role, department_id = 'manager', department_ids[i]
+            else:
+                role = 'agent'
+                department_id = rng.choices(department_ids, department_weights)[0]
+                agents_by_department[department_id].append(user_id)
+            users.append({
+                'id': user_id, 'username': f'{role}{user_id}', 'name': f'{role.capitalize()} {user_id}',
+                'email': f'{role}{user_id}@exemplo.com', 'password_hash': password_hash, 'role': role,
+                'department_id': department_id, 'is_active': True, 'created_at': start, 'updated_at': start
+            })
+        connection.execute(insert(User), users)
+        counts['users'] = len(users)
+        for department_id, members in agents_by_department.items():
+            if not members:
+                members.append(first_user + department_ids.index(department_id))
+        connection.commit()
+
+        lengths = thread_lengths(rng, conversations, messages)
+        first_conversation = next_id(connection, Conversation.__table__)
+        message_id = next_id(connection, Message.__table__)
+        transfer_id = next_id(connection, Transfer.__table__)
+
+        # Conversas em ordem cronológica, para que só a última de cada contato fique ativa
+        span = (end - start).total_seconds()
+        openings = []
+        for _ in range(conversations):
+            day = rng.randrange(max(days, 1))
+            hour = bisect.bisect_right(hours, rng.random() * hours[-1])
+            openings.append(start + timedelta(days=day, hours=hour, seconds=rng.randrange(3600)))
+        openings.sort()
+
+        conversation_rows, message_rows, transfer_rows = [], [], []
+        active_contacts = set()
+        started = time.perf_counter()
+
+        def flush(final=False):
+            if conversation_rows:
+                connection.execute(insert(Conversation), conversation_rows)
+                conversation_rows.clear()
+            if message_rows:
+                connection.execute(insert(Message), message_rows)
+                counts['messages'] += len(message_rows)
+                message_rows.clear()
+            if transfer_rows:
+                connection.execute(insert(Transfer), transfer_rows)
+                counts['transfers'] += len(transfer_rows)
+                transfer_rows.clear()
+            connection.commit()
+            if progress and not final:
+                elapsed = time.perf_counter() - started
+                progress(f'  {counts["messages"]:,} mensagens ({counts["messages"] / elapsed:,.0f}/s)')
+
+        for index in range(conversations):
+            conversation_id = first_conversation + index
+            contact = index if index < contacts else rng.randrange(contacts)
+            contact_id = f'55{11_900_000_000 + contact}'
+            created_at = openings[index]
+            length = lengths[index]
+
+            # Conversas recentes tendem a estar abertas; antigas, fechadas
+            age_days = (end - created_at).total_seconds() / 86400
+            active_probability = 0.7 if age_days < 2 else 0.25 if age_days < 7 else 0.02
+            active = rng.random() < active_probability and contact not in active_contacts
+            if active:
+                active_contacts.add(contact)
+
+            department_id = rng.choices(department_ids, department_weights)[0]
+            agent_id = None if active and rng.random() < 0.2 else rng.choice(agents_by_department[department_id])
+
+            # Transferências em pontos aleatórios da conversa
+            transfer_points = {}
+            if length >= 3 and rng.random() < transfer_rate:
+                for point in rng.sample(range(1, length - 1), 1 if rng.random() < 0.8 else min(2, length - 2)):
+                    transfer_points[point] = None
+
+            moment = created_at
+            last = None
+            for position in range(length):
+                moment += timedelta(seconds=int(rng.expovariate(1 / 180)) + 1)
+                if position in transfer_points:
+                    to_department = rng.choice([d for d in department_ids if d != department_id] or department_ids)
+                    to_agent = rng.choice(agents_by_department[to_department])
+                    transfer_rows.append({
+                        'id': transfer_id, 'conversation_id': conversation_id,
+                        'from_department_id': department_id, 'to_department_id': to_department,
+                        'from_agent_id': agent_id, 'to_agent_id': to_agent,
+                        'reason': rng.choice(TRANSFER_REASONS), 'status': 'accepted',
+                        'created_at': moment, 'updated_at': moment
+                    })
+                    transfer_id += 1
+                    content = f'Conversa transferida de {names[department_ids.index(department_id)]} para {names[department_ids.index(to_department)]}.'
+                    department_id, agent_id = to_department, to_agent
+                    last = ('system', None, content, 'system')
+                elif position % 2 == 0 or rng.random() < 0.3:
+                    last = ('customer', None, rng.choice(CUSTOMER_TEXTS), 'text')
+                else:
+                    last = ('agent', agent_id, rng.choice(AGENT_TEXTS), 'text')
+                sender_type, sender_id, content, message_type = last
+                message_rows.append({
+                    'id': message_id, 'conversation_id': conversation_id, 'sender_type': sender_type,
+                    'sender_id': sender_id, 'content': content, 'message_type': message_type,
+                    'timestamp': moment, 'delivery_status': delivery_status(rng) if sender_type == 'agent' else None
+                })
+                message_id += 1
+
+            status = ('transferred' if transfer_points and rng.random() < 0.3 else 'open') if active else 'closed'
+            conversation_rows.append({
+                'id': conversation_id, 'whatsapp_contact_id': contact_id,
+                'contact_name': f'Cliente {contact}', 'contact_phone': contact_id,
+                'department_id': department_id, 'assigned_agent_id': agent_id, 'status': status,
+                'created_at': created_at, 'updated_at': moment,
+                'message_count': length, 'last_message_preview': last[2][:PREVIEW_LENGTH],
+                'last_message_at': moment, 'last_sender_type': last[0]
+            })
+
+            if len(message_rows) >= batch_size:
+                flush()
+        flush(final=True)
+
+    return counts
+
+
+def drop_managed_indexes(engine):
+    """Remover os índices declarados nos modelos (recriados por ensure_indexes depois da carga)"""
+    with engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                connection.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+
+
+def create_app(url):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    db.init_app(app)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', help='Arquivo SQLite (alternativa a DATABASE_URL)')
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--conversations', type=int, help='Padrão: uma para cada 20 mensagens')
+    parser.add_argument('--contacts', type=int, help='Padrão: 80%% das conversas')
+    parser.add_argument('--departments', type=int, default=8)
+    parser.add_argument('--agents', type=int, default=200)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--transfer-rate', type=float, default=0.12)
+    parser.add_argument('--batch-size', type=int, default=50_000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    if args.database:
+        url = f'sqlite:///{os.path.abspath(args.database)}'
+    else:
+        url = os.environ.get('DATABASE_URL')
+        if not url:
+            parser.error('informe --database ou DATABASE_URL')
+
+    app = create_app(url)
+    with app.app_context():
+        db.create_all()
+        drop_managed_indexes(db.engine)
+
+        conversations = args.conversations or max(1, args.messages // 20)
+        print(f'Gerando {args.messages:,} mensagens em {conversations:,} conversas...')
+        started = time.perf_counter()
+        counts = generate_dataset(
+            db.engine, messages=args.messages, conversations=conversations, contacts=args.contacts,
+            departments=args.departments, agents=args.agents, days=args.days,
+            transfer_rate=args.transfer_rate, batch_size=args.batch_size, seed=args.seed
+        )
+        print(f'Carga: {time.perf_counter() - started:.1f}s  ' +
+              '  '.join(f'{table}: {count:,}' for table, count in counts.items()))
+
+        started = time.perf_counter()
+        created = ensure_indexes()
+        with db.engine.begin() as connection:
+            connection.execute(text('ANALYZE'))
+        print(f'Índices: {len(created)} em {time.perf_counter() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
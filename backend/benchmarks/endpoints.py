@@ -0,0 +1,368 @@
+"""Latência e vazão dos endpoints mais usados, no processo ou via HTTP (gunicorn)
+
+Cenários: rajadas do webhook (N mensagens por payload), caixa de entrada de
+agente, gerente e admin, histórico de uma conversa longa, envio de mensagem,
+upload e download. Cada execução usa um banco e uma pasta de uploads
+temporários, imprime p50/p95/p99 e requisições/s e pode gravar um baseline
+JSON para comparar entre commits:
+
+    cd backend && python -m benchmarks.endpoints --save /tmp/antes.json
+    cd backend && python -m benchmarks.endpoints --compare /tmp/antes.json
+    cd backend && python -m benchmarks.endpoints --http --workers 4 --concurrency 16
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = [
+    'webhook', 'webhook_process', 'inbox_agent', 'inbox_manager', 'inbox_admin',
+    'history', 'send', 'upload', 'download'
+]
+
+
+class InProcessClient:
+    """Requisições direto no app Flask, sem rede"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, headers=None, json=None):
+        response = self.client.open(path, method=method, headers=headers, json=json)
+        return response.status_code, response.get_data()
+
+    def upload(self, path, headers, filename, content):
+        response = self.client.post(path, headers=headers, data={'file': (io.BytesIO(content), filename)},
+                                    content_type='multipart/form-data')
+        return response.status_code, response.get_data()
+
+
+class HttpClient:
+    """Requisições HTTP com keep-alive contra um servidor local"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.session = requests.Session()
+
+    def request(self, method, path, headers=None, json=None):
+        response = self.session.request(method, self.base_url + path, headers=headers, json=json)
+        return response.status_code, response.content
+
+    def upload(self, path, headers, filename, content):
+        response = self.session.post(self.base_url + path, headers=headers, files={'file': (filename, content)})
+        return response.status_code, response.content
+
+
+def percentile(values, p):
+    """Percentil com interpolação linear sobre valores ordenados"""
+    if not values:
+        return 0.0
+    position = (len(values) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def run_scenario(make_client, call, total, concurrency):
+    """Executar total chamadas em concurrency threads; retorna as estatísticas"""
+    latencies = []
+    errors = [0]
+    counter = iter(range(total))
+    lock = threading.Lock()
+
+    def worker():
+        client = make_client()
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            started = time.perf_counter()
+            status = call(client, i)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if status >= 400:
+                    errors[0] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(max(1, min(concurrency, total)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'concurrency': concurrency,
+        'throughput': round(len(latencies) / wall, 2) if wall else 0.0,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def webhook_payload(rng, batch_size, contacts):
+    return {'entry': [{'changes': [{'field': 'messages', 'value': {'messages': [
+        {'from': rng.choice(contacts), 'id': f'wamid.{rng.getrandbits(64):x}', 'type': 'text',
+         'text': {'body': 'mensagem de teste de carga'}}
+        for _ in range(batch_size)
+    ]}}]}]}
+
+
+def seed(app, args):
+    """Usuários, conversas e uma conversa longa, gravados pelo mesmo caminho do webhook"""
+    from src.models.user import db, User, Department, Message
+    from src.routes.whatsapp import process_whatsapp_messages
+
+    rng = random.Random(args.seed)
+    with app.app_context():
+        department = Department.query.filter_by(name='Suporte').first()
+        for username, role in (('bench_agent', 'agent'), ('bench_manager', 'manager')):
+            user = User(username=username, name=username, email=f'{username}@exemplo.com',
+                        role=role, department_id=department.id, is_active=True)
+            user.set_password(username)
+            db.session.add(user)
+        db.session.commit()
+
+        contacts = [f'55119{i:08d}' for i in range(args.conversations)]
+        for start in range(0, len(contacts), 500):
+            process_whatsapp_messages([{'messages': [
+                {'from': contact, 'type': 'text', 'text': {'body': 'olá'}}
+                for contact in contacts[start:start + 500]
+            ]}])
+
+        long_contact = contacts[0]
+        for start in range(0, args.thread_length, 1000):
+            process_whatsapp_messages([{'messages': [
+                {'from': long_contact, 'type': 'text', 'text': {'body': f'mensagem {i}'}}
+                for i in range(start, min(start + 1000, args.thread_length))
+            ]}])
+
+        long_conversation = Message.query.order_by(Message.id.desc()).first().conversation_id
+        message_ids = [row[0] for row in db.session.query(Message.id).filter_by(conversation_id=long_conversation)]
+        conversation_ids = sorted({row[0] for row in db.session.query(Message.conversation_id).distinct()})
+    return {
+        'contacts': contacts,
+        'long_conversation': long_conversation,
+        'message_ids': message_ids,
+        'conversation_ids': conversation_ids,
+        'rng': rng,
+    }
+
+
+def start_gunicorn(env, workers):
+    """Subir o gunicorn numa porta livre e esperar o /api/health responder"""
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--bind', f'127.0.0.1:{port}', 'src.main:app'],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(base_url + '/api/health', timeout=1).status_code == 200:
+                return process, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('gunicorn não respondeu em 60s')
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def drain_http(client, headers, messages):
+    """Esperar a fila do webhook esvaziar; vazão em mensagens/s"""
+    started = time.perf_counter()
+    deadline = time.monotonic() + 600
+    while time.monotonic() < deadline:
+        status, body = client.request('GET', '/api/webhook/queue', headers=headers)
+        if status == 200 and json.loads(body)['backlog'] == 0:
+            break
+        time.sleep(0.05)
+    wall = time.perf_counter() - started
+    return {
+        'requests': messages, 'errors': 0, 'concurrency': None,
+        'throughput': round(messages / wall, 2) if wall else 0.0,
+        'mean_ms': 0.0, 'p50_ms': 0.0, 'p95_ms': 0.0, 'p99_ms': 0.0,
+    }
+
+
+def compare(results, baseline_path, threshold):
+    """Comparar com um baseline; retorna True se houver regressão acima do limite"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f'\nComparação com {baseline_path} (commit {baseline.get("commit")}, modo {baseline.get("mode")})')
+    if baseline.get('mode') != results['mode'] or baseline.get('params') != results['params']:
+        print('  Atenção: modo ou parâmetros diferentes do baseline; a comparação é apenas indicativa')
+    regressed = False
+    for name, current in results['scenarios'].items():
+        previous = baseline['scenarios'].get(name)
+        if not previous:
+            continue
+        changes = []
+        flagged = False
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if not previous[key] or not current[key]:
+                continue
+            change = (current[key] - previous[key]) / previous[key]
+            changes.append(f'{key[:3]} {change:+.0%}')
+            flagged |= key == 'p95_ms' and change > threshold
+        change = (current['throughput'] - previous['throughput']) / previous['throughput'] if previous['throughput'] else 0.0
+        changes.append(f'req/s {change:+.0%}')
+        flagged |= change < -threshold
+        regressed |= flagged
+        print(f'  {name:<16} {"  ".join(changes)}{"  REGRESSÃO" if flagged else ""}')
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--http', action='store_true', help='Medir via HTTP contra um gunicorn local')
+    parser.add_argument('--workers', type=int, default=2, help='Workers do gunicorn (--http)')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=200, help='Requisições por cenário')
+    parser.add_argument('--batch-size', type=int, default=20, help='Mensagens por payload do webhook')
+    parser.add_argument('--conversations', type=int, default=2000)
+    parser.add_argument('--thread-length', type=int, default=5000, help='Mensagens da conversa longa')
+    parser.add_argument('--upload-size', type=int, default=64 * 1024)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save', help='Gravar o resultado neste arquivo JSON')
+    parser.add_argument('--compare', help='Baseline JSON para comparar')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Piora de p95/vazão tolerada na comparação')
+    args = parser.parse_args()
+    scenarios = [name for name in args.scenarios.split(',') if name]
+
+    workdir = tempfile.mkdtemp(prefix='whatsapp-bench-')
+    os.environ.update({
+        'DATABASE_URL': f'sqlite:///{os.path.join(workdir, "app.db")}',
+        'WEBHOOK_QUEUE_PATH': os.path.join(workdir, 'webhook_queue.db'),
+        'UPLOAD_FOLDER': os.path.join(workdir, 'uploads'),
+        'PROMETHEUS_MULTIPROC_DIR': os.path.join(workdir, 'prometheus'),
+        'RATELIMIT_ENABLED': '0',
+        'WEBHOOK_QUEUE_WORKERS': '0',
+    })
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'])
+    sys.path.insert(0, BACKEND_DIR)
+    from src.main import app
+    from src.services.webhook_queue import webhook_queue
+
+    print(f'Gerando {args.conversations} conversas e uma conversa de {args.thread_length} mensagens...')
+    started = time.perf_counter()
+    data = seed(app, args)
+    print(f'  {time.perf_counter() - started:.1f}s ({workdir})')
+
+    server = None
+    if args.http:
+        env = dict(os.environ, WEBHOOK_QUEUE_WORKERS='2')
+        server, base_url = start_gunicorn(env, args.workers)
+        make_client = lambda: HttpClient(base_url)
+    else:
+        make_client = lambda: InProcessClient(app)
+
+    try:
+        client = make_client()
+        tokens = {}
+        for role, username, password in (('admin', 'admin', 'admin123'), ('agent', 'bench_agent', 'bench_agent'),
+                                         ('manager', 'bench_manager', 'bench_manager')):
+            status, body = client.request('POST', '/api/login', json={'username': username, 'password': password})
+            tokens[role] = {'Authorization': f'Bearer {json.loads(body)["token"]}'}
+
+        rng = data['rng']
+        payloads = [webhook_payload(rng, args.batch_size, data['contacts']) for _ in range(args.requests)]
+        befores = [rng.choice(data['message_ids']) for _ in range(args.requests)]
+        conversation_ids = data['conversation_ids']
+        upload_content = os.urandom(args.upload_size)
+        uploaded = []
+
+        def upload(client, i):
+            status, body = client.upload('/api/upload', tokens['admin'], f'bench{i}.txt', upload_content)
+            if status == 200:
+                uploaded.append(json.loads(body)['file_path'])
+            return status
+
+        calls = {
+            'webhook': lambda client, i: client.request('POST', '/api/webhook', json=payloads[i])[0],
+            'inbox_agent': lambda client, i: client.request(
+                'GET', '/api/conversations?status=open&per_page=20', headers=tokens['agent'])[0],
+            'inbox_manager': lambda client, i: client.request(
+                'GET', '/api/conversations?status=open&per_page=20', headers=tokens['manager'])[0],
+            'inbox_admin': lambda client, i: client.request(
+                'GET', '/api/conversations?status=open&per_page=20', headers=tokens['admin'])[0],
+            'history': lambda client, i: client.request(
+                'GET', f'/api/conversations/{data["long_conversation"]}/messages?limit=50&before={befores[i]}',
+                headers=tokens['admin'])[0],
+            'send': lambda client, i: client.request(
+                'POST', f'/api/conversations/{conversation_ids[i % len(conversation_ids)]}/messages',
+                headers=tokens['admin'], json={'content': 'resposta de teste de carga'})[0],
+            'upload': upload,
+            'download': lambda client, i: client.request(
+                'GET', f'/api/files/{uploaded[i % len(uploaded)]}', headers=tokens['admin'])[0],
+        }
+
+        results = {
+            'commit': git_commit(),
+            'created_at': datetime.utcnow().isoformat(),
+            'mode': 'http' if args.http else 'in-process',
+            'python': platform.python_version(),
+            'params': {key: value for key, value in vars(args).items() if key not in ('save', 'compare')},
+            'scenarios': {},
+        }
+
+        print(f'\n{"cenário":<16} {"req":>6} {"erros":>6} {"req/s":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}')
+        for name in scenarios:
+            if name == 'webhook_process':
+                if args.http:
+                    # Os workers do gunicorn drenam a fila; mede-se só a vazão até esvaziar
+                    stats = drain_http(client, tokens['admin'], args.requests * args.batch_size)
+                else:
+                    # Um payload por chamada: o lote inteiro numa transação
+                    stats = run_scenario(lambda: None, lambda _, i: 200 if webhook_queue.process_next() else 404,
+                                         webhook_queue.stats()['pending'], 1)
+            elif name == 'download' and not uploaded:
+                continue
+            else:
+                stats = run_scenario(make_client, calls[name], args.requests, args.concurrency)
+            results['scenarios'][name] = stats
+            print(f'{name:<16} {stats["requests"]:>6} {stats["errors"]:>6} {stats["throughput"]:>9.1f} '
+                  f'{stats["p50_ms"]:>9.2f} {stats["p95_ms"]:>9.2f} {stats["p99_ms"]:>9.2f}')
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'\nResultado gravado em {args.save}')
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Servidor local que imita o endpoint de envio da WhatsApp Cloud API
+
+Aponte WHATSAPP_API_URL para ele para testar o envio sem acessar a Meta:
+
+    cd backend && python -m benchmarks.fake_graph_api --port 8900 --latency 0.05 --error-rate 0.1
+    WHATSAPP_API_URL=http://127.0.0.1:8900/v18.0 python src/main.py
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeGraphAPI(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, error_rate=0.0, status=None):
+        super().__init__(address, FakeGraphAPIHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.status = status
+        self.ids = itertools.count(1)
+        self.received = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/v18.0'
+
+
+class FakeGraphAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, como a API real
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if server.latency:
+            time.sleep(server.latency)
+
+        status = server.status
+        if status is None:
+            status = 503 if random.random() < server.error_rate else 200
+
+        if status == 200 and self.path.endswith('/messages'):
+            payload = json.loads(body or b'{}')
+            with server.lock:
+                message_id = f'wamid.fake{next(server.ids)}'
+                server.received.append((self.path, self.headers.get('Authorization'), payload))
+            response = {
+                'messaging_product': 'whatsapp',
+                'contacts': [{'input': payload.get('to'), 'wa_id': payload.get('to')}],
+                'messages': [{'id': message_id}]
+            }
+        else:
+            status = status if status != 200 else 404
+            response = {'error': {'message': 'erro simulado', 'code': status}}
+
+        data = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_in_thread(port=0, **kwargs):
+    """Iniciar o servidor em uma thread (para testes); retorna o servidor"""
+    server = FakeGraphAPI(('127.0.0.1', port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=0.0, help='Segundos por requisição')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fração de respostas 503')
+    args = parser.parse_args()
+
+    server = FakeGraphAPI(('127.0.0.1', args.port), latency=args.latency, error_rate=args.error_rate)
+    print(f'Fake Graph API em {server.url}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
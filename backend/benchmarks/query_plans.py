@@ -0,0 +1,86 @@
+"""Planos de consulta da caixa de entrada e do histórico de mensagens
+
+Cria um banco SQLite sintético (por padrão 1M de mensagens, com o gerador de
+benchmarks.dataset), aplica os índices
+gerenciados e imprime o EXPLAIN QUERY PLAN e o tempo das consultas reais dos
+endpoints GET /api/conversations e GET /api/conversations/<id>.
+
+    cd backend && python -m benchmarks.query_plans --messages 1000000
+"""
+import argparse
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+from sqlalchemy import select, text
+
+from benchmarks.dataset import create_app, drop_managed_indexes, generate_dataset
+from src.models.user import db, User, Conversation, Message
+from src.models.schema import ensure_indexes
+from src.routes.conversation import inbox_query
+
+def explain(query):
+    statement = query.statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+    plan = db.session.execute(text(f'EXPLAIN QUERY PLAN {statement}')).all()
+    started = time.perf_counter()
+    query.all()
+    elapsed = (time.perf_counter() - started) * 1000
+    return [row[-1] for row in plan], elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--conversations', type=int, default=100_000)
+    parser.add_argument('--departments', type=int, default=10)
+    parser.add_argument('--agents', type=int, default=200)
+    parser.add_argument('--database', help='Arquivo SQLite (padrão: temporário)')
+    args = parser.parse_args()
+
+    path = args.database or os.path.join(tempfile.mkdtemp(), 'query_plans.db')
+    app = create_app(f'sqlite:///{path}')
+
+    with app.app_context():
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            # Tabelas sem índices, para medir também o custo do ensure_indexes
+            db.create_all()
+            drop_managed_indexes(db.engine)
+            print(f'Gerando {args.messages} mensagens em {args.conversations} conversas...')
+            started = time.perf_counter()
+            generate_dataset(db.engine, messages=args.messages, conversations=args.conversations,
+                             departments=args.departments, agents=args.agents, progress=None)
+            print(f'  {time.perf_counter() - started:.1f}s')
+
+        started = time.perf_counter()
+        created = ensure_indexes()
+        db.session.execute(text('ANALYZE'))
+        print(f'Índices criados: {", ".join(created) or "nenhum"} ({time.perf_counter() - started:.1f}s)')
+
+        agent = db.session.scalars(select(User).filter_by(role='agent').order_by(User.id).limit(1)).one()
+        principals = {
+            'agent': agent,
+            'manager': SimpleNamespace(id=0, role='manager', department_id=agent.department_id),
+            'admin': SimpleNamespace(id=0, role='admin', department_id=None),
+        }
+        conversation_id = db.session.execute(text(
+            'SELECT conversation_id FROM message GROUP BY conversation_id ORDER BY COUNT(*) DESC LIMIT 1'
+        )).scalar()
+
+        cases = [
+            (f'inbox {role}', inbox_query(principal, 'open').order_by(Conversation.updated_at.desc()).limit(10))
+            for role, principal in principals.items()
+        ]
+        cases.append((f'historico conversa {conversation_id}', Message.query.filter_by(
+            conversation_id=conversation_id
+        ).order_by(Message.timestamp.asc())))
+
+        for name, query in cases:
+            plan, elapsed = explain(query)
+            print(f'\n{name}: {elapsed:.2f} ms')
+            for line in plan:
+                print(f'  {line}')
+
+
+if __name__ == '__main__':
+    main()
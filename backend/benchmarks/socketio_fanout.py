@@ -0,0 +1,97 @@
+"""Vazão do pub/sub do Socket.IO entre N workers
+
+Um publicador emite E eventos para uma sala; cada worker (processo, ou thread
+no backend memory://) tem seu próprio servidor Socket.IO ligado ao mesmo canal
+e conta os eventos recebidos. Reporta eventos/s publicados e entregas/s.
+
+    cd backend && python -m benchmarks.socketio_fanout --workers 4 --events 20000
+    cd backend && python -m benchmarks.socketio_fanout --backend redis://localhost:6379/0
+"""
+import argparse
+import multiprocessing
+import tempfile
+import threading
+import time
+
+import socketio
+
+from src.services.realtime import create_client_manager
+
+CHANNEL = 'benchmark-socketio'
+
+
+def make_manager(url, write_only=False):
+    return create_client_manager(url, channel=CHANNEL, write_only=write_only)
+
+
+def run_worker(url, events, ready, results):
+    """Servidor Socket.IO que conta os eventos recebidos pelo pub/sub"""
+    manager = make_manager(url)
+    received = [0]
+    first = [None]
+    done = threading.Event()
+    handle_emit = manager._handle_emit
+
+    def counting_handle_emit(message):
+        if first[0] is None:
+            first[0] = time.perf_counter()
+        received[0] += 1
+        handle_emit(message)
+        if received[0] >= events:
+            done.set()
+
+    manager._handle_emit = counting_handle_emit
+    server = socketio.Server(async_mode='threading', client_manager=manager)
+    server.manager_initialized = True
+    manager.initialize()
+
+    ready.put(True)
+    done.wait(120)
+    results.put((received[0], time.perf_counter()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--payload-size', type=int, default=256, help='Bytes de conteúdo por evento')
+    parser.add_argument('--backend', default=None, help='URL do pub/sub (padrão: unix:// em diretório temporário)')
+    args = parser.parse_args()
+
+    url = args.backend or f'unix://{tempfile.mkdtemp()}'
+    in_process = url.startswith('memory://')
+
+    if in_process:
+        import queue
+        ready, results = queue.Queue(), queue.Queue()
+        spawn = lambda: threading.Thread(target=run_worker, args=(url, args.events, ready, results), daemon=True)
+    else:
+        context = multiprocessing.get_context('spawn')
+        ready, results = context.Queue(), context.Queue()
+        spawn = lambda: context.Process(target=run_worker, args=(url, args.events, ready, results), daemon=True)
+
+    workers = [spawn() for _ in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    for _ in workers:
+        ready.get(timeout=60)
+
+    publisher = socketio.Server(async_mode='threading', client_manager=make_manager(url, write_only=True))
+    payload = {'conversation_id': 1, 'message': {'content': 'x' * args.payload_size}}
+
+    started = time.perf_counter()
+    for _ in range(args.events):
+        publisher.emit('new_message', payload, room='conversation_1')
+    published = time.perf_counter() - started
+
+    outcomes = [results.get(timeout=180) for _ in workers]
+    finished = max(ended for _, ended in outcomes) - started
+    delivered = sum(count for count, _ in outcomes)
+
+    print(f'backend: {url.split("://")[0]}://  workers: {args.workers}  eventos: {args.events}')
+    print(f'publicação: {args.events / published:,.0f} eventos/s')
+    print(f'entrega:    {delivered / finished:,.0f} entregas/s ({delivered}/{args.events * args.workers} recebidas em {finished:.2f}s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+import os
+import shutil
+
+# Métricas do Prometheus com vários workers: cada processo grava suas séries neste
+# diretório e o /metrics agrega todos. Precisa estar definido antes do fork.
+prometheus_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/whatsapp-prometheus')
+
+
+def on_starting(server):
+    """Limpar séries de execuções anteriores"""
+    shutil.rmtree(prometheus_dir, ignore_errors=True)
+    os.makedirs(prometheus_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """Descartar os gauges do worker que saiu"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -3,19 +3,32 @@ import sys
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from flask import Flask, send_from_directory, request
+import time
+import click
+from flask import Flask, send_from_directory, request, jsonify
 from flask_cors import CORS
-from flask_socketio import SocketIO, emit, join_room, leave_room
+from flask_socketio import emit, join_room, leave_room, rooms, ConnectionRefusedError
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 
 from src.models.user import db, User, Department
-from src.routes.auth import auth_bp
+from src.models.schema import ensure_columns, ensure_indexes, backfill_conversation_summaries
+from src.routes.auth import auth_bp, principal_from_token, token_required, admin_required
 from src.routes.user import user_bp
 from src.routes.department import department_bp
-from src.routes.whatsapp import whatsapp_bp
+from src.routes.whatsapp import whatsapp_bp, process_webhook_payload
 from src.routes.conversation import conversation_bp
-from src.routes.file import file_bp
+from src.routes.file import file_bp, ALLOWED_EXTENSIONS
+from src.services.webhook_queue import webhook_queue
+from src.services.outbound import outbound_sender
+from src.services.attachments import reconcile_attachments, expire_upload_sessions
+from src.services.blob_store import blob_store
+from src.services.thumbnails import thumbnail_pool
+from src.services import conversation_routing, database, metrics, query_stats, realtime, room_acl, typing_indicator
+from src.services.realtime import socketio
+from src.services.inbox import inbox_rooms, inbox_events_since, latest_inbox_seq
+from src.services.typing_indicator import typing_tracker
+from src.services.room_acl import attach_principal, detach_principal, socket_principal, can_join_conversation
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'your-secret-key-change-in-production'
@@ -23,20 +36,127 @@ app.config['SECRET_KEY'] = 'your-secret-key-change-in-production'
 # Configuração CORS
 CORS(app, origins="*")
 
-# Configuração SocketIO
-socketio = SocketIO(app, cors_allowed_origins="*")
+# Configuração SocketIO (SOCKETIO_MESSAGE_QUEUE: redis://, amqp://, unix:// (sockets em
+# instance/socketio, ou unix:///dir) ou memory:// para distribuir os eventos entre
+# vários workers do gunicorn)
+app.config['SOCKETIO_MESSAGE_QUEUE'] = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+# Mensagens novas são agrupadas por conversa nesta janela; clientes com mais de
+# SOCKETIO_CLIENT_BUFFER pacotes pendentes deixam de receber lotes e recebem 'resync'
+app.config['SOCKETIO_BATCH_WINDOW_MS'] = int(os.environ.get('SOCKETIO_BATCH_WINDOW_MS', 40))
+app.config['SOCKETIO_CLIENT_BUFFER'] = int(os.environ.get('SOCKETIO_CLIENT_BUFFER', 64))
+# 'new_message' por mensagem além do lote 'new_messages': necessário enquanto o bundle
+# em src/static não for recompilado a partir do frontend atual (desligue com 0 depois)
+app.config['SOCKETIO_LEGACY_NEW_MESSAGE'] = os.environ.get('SOCKETIO_LEGACY_NEW_MESSAGE', '1') == '1'
+realtime.init_app(app)
 
-# Rate limiting
+# Rate limiting (RATELIMIT_ENABLED=0 desliga, ex.: testes de carga)
+app.config['RATELIMIT_ENABLED'] = os.environ.get('RATELIMIT_ENABLED', '1') == '1'
 limiter = Limiter(
     key_func=get_remote_address,
     app=app,
     default_limits=["100 per 15 minutes"]
 )
 
-# Configuração do banco de dados
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
+# Configuração do banco de dados (DATABASE_URL: sqlite:///, postgresql://, mysql://...)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+    'DATABASE_URL',
+    f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
+)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db.init_app(app)
+# SQLite: PRAGMAs aplicados a cada conexão (WAL permite leituras durante a escrita
+# dos outros workers; busy_timeout em ms espera pelo lock em vez de falhar)
+app.config['SQLITE_JOURNAL_MODE'] = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+app.config['SQLITE_BUSY_TIMEOUT'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+app.config['SQLITE_MMAP_SIZE'] = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+app.config['SQLITE_CACHE_SIZE'] = int(os.environ.get('SQLITE_CACHE_SIZE', -64000))
+# Bancos servidor: pool por processo (multiplicar pelo número de workers do gunicorn)
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 10))
+app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+app.config['DB_POOL_TIMEOUT'] = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+app.config['DB_POOL_PRE_PING'] = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+database.init_app(app)
+
+# Instrumentação SQL por requisição (cabeçalho Server-Timing, detecção de N+1);
+# SQL_STRICT=1 com SQL_QUERY_BUDGET faz a requisição que estourar o orçamento falhar
+app.config['SQL_INSTRUMENTATION'] = os.environ.get('SQL_INSTRUMENTATION', '1') == '1'
+app.config['SQL_LOG_REQUESTS'] = os.environ.get('SQL_LOG_REQUESTS', '0') == '1'
+app.config['SQL_N_PLUS_ONE_THRESHOLD'] = int(os.environ.get('SQL_N_PLUS_ONE_THRESHOLD', 5))
+app.config['SQL_QUERY_BUDGET'] = int(os.environ.get('SQL_QUERY_BUDGET', 0))
+app.config['SQL_STRICT'] = os.environ.get('SQL_STRICT', '0') == '1'
+query_stats.init_app(app)
+
+# Métricas do Prometheus em /metrics
+metrics.init_app(app)
+
+# Fila de ingestão do webhook
+app.config['WEBHOOK_QUEUE_PATH'] = os.environ.get(
+    'WEBHOOK_QUEUE_PATH',
+    os.path.join(os.path.dirname(__file__), 'database', 'webhook_queue.db')
+)
+app.config['WEBHOOK_QUEUE_WORKERS'] = int(os.environ.get('WEBHOOK_QUEUE_WORKERS', 2))
+app.config['WEBHOOK_QUEUE_VISIBILITY_TIMEOUT'] = int(os.environ.get('WEBHOOK_QUEUE_VISIBILITY_TIMEOUT', 60))
+app.config['WEBHOOK_QUEUE_MAX_ATTEMPTS'] = int(os.environ.get('WEBHOOK_QUEUE_MAX_ATTEMPTS', 5))
+webhook_queue.init_app(app, handler=process_webhook_payload)
+
+# Autenticação: cache do usuário por processo e janela de confiança nas claims do JWT
+# (AUTH_TRUST_CLAIMS_SECONDS > 0 dispensa o banco, mas alterações feitas em outros
+# processos só passam a valer quando a janela expira)
+app.config['AUTH_CACHE_TTL'] = int(os.environ.get('AUTH_CACHE_TTL', 30))
+app.config['AUTH_TRUST_CLAIMS_SECONDS'] = int(os.environ.get('AUTH_TRUST_CLAIMS_SECONDS', 0))
+
+# Envio de mensagens para a WhatsApp Cloud API
+app.config['WHATSAPP_API_URL'] = os.environ.get('WHATSAPP_API_URL', 'https://graph.facebook.com/v18.0')
+app.config['WHATSAPP_PHONE_ID'] = os.environ.get('WHATSAPP_PHONE_ID')
+app.config['OUTBOUND_WORKERS'] = int(os.environ.get('OUTBOUND_WORKERS', 4))
+app.config['OUTBOUND_QUEUE_SIZE'] = int(os.environ.get('OUTBOUND_QUEUE_SIZE', 1000))
+app.config['OUTBOUND_MAX_RETRIES'] = int(os.environ.get('OUTBOUND_MAX_RETRIES', 5))
+app.config['OUTBOUND_RATE_PER_SECOND'] = float(os.environ.get('OUTBOUND_RATE_PER_SECOND', 20))
+app.config['OUTBOUND_TIMEOUT'] = float(os.environ.get('OUTBOUND_TIMEOUT', 10))
+app.config['OUTBOUND_BREAKER_THRESHOLD'] = int(os.environ.get('OUTBOUND_BREAKER_THRESHOLD', 5))
+app.config['OUTBOUND_BREAKER_RESET'] = float(os.environ.get('OUTBOUND_BREAKER_RESET', 30))
+# Envio não concluído em OUTBOUND_MAX_AGE segundos vira 'failed'; mensagens 'pending'
+# mais antigas que isso são reenfileiradas na inicialização (OUTBOUND_RESUME=0 desliga)
+app.config['OUTBOUND_MAX_AGE'] = float(os.environ.get('OUTBOUND_MAX_AGE', 600))
+app.config['OUTBOUND_RESUME'] = os.environ.get('OUTBOUND_RESUME', '1') == '1'
+outbound_sender.init_app(app)
+
+# Entrega dos anexos: 'app' (Flask, com Range/ETag), 'x-sendfile' (Apache/lighttpd) ou
+# 'x-accel' (nginx, location interna FILE_ACCEL_PREFIX apontando para a pasta de uploads);
+# nos dois últimos o Python só autentica e o servidor da frente envia os bytes
+app.config['FILE_DELIVERY'] = os.environ.get('FILE_DELIVERY', 'app')
+app.config['FILE_ACCEL_PREFIX'] = os.environ.get('FILE_ACCEL_PREFIX', '/protected-uploads/')
+app.config['FILE_CACHE_MAX_AGE'] = int(os.environ.get('FILE_CACHE_MAX_AGE', 365 * 24 * 3600))
+app.config['USE_X_SENDFILE'] = app.config['FILE_DELIVERY'] == 'x-sendfile'
+
+# Uploads retomáveis (POST /api/uploads, PUT em pedaços, /complete); sessões sem
+# atividade por RESUMABLE_UPLOAD_TTL segundos são recolhidas
+app.config['RESUMABLE_MAX_SIZE'] = int(os.environ.get('RESUMABLE_MAX_SIZE', 100 * 1024 * 1024))
+app.config['RESUMABLE_CHUNK_SIZE'] = int(os.environ.get('RESUMABLE_CHUNK_SIZE', 4 * 1024 * 1024))
+app.config['RESUMABLE_UPLOAD_TTL'] = int(os.environ.get('RESUMABLE_UPLOAD_TTL', 24 * 3600))
+
+# Miniaturas e prévias dos anexos (imagens com Pillow, PDFs com pdftoppm, ambos opcionais)
+app.config['THUMBNAIL_WORKERS'] = int(os.environ.get('THUMBNAIL_WORKERS', 2))
+app.config['THUMBNAIL_QUALITY'] = int(os.environ.get('THUMBNAIL_QUALITY', 80))
+thumbnail_pool.init_app(app)
+
+# Cache contato -> conversa ativa
+app.config['CONTACT_CACHE_SIZE'] = int(os.environ.get('CONTACT_CACHE_SIZE', 10000))
+conversation_routing.init_app(app)
+
+# Autorização das salas de conversa do Socket.IO: dono da conversa em cache por
+# processo (transferências no próprio processo atualizam na hora)
+app.config['ROOM_ACL_CACHE_SIZE'] = int(os.environ.get('ROOM_ACL_CACHE_SIZE', 50000))
+app.config['ROOM_ACL_TTL'] = int(os.environ.get('ROOM_ACL_TTL', 60))
+room_acl.init_app(app)
+
+# Indicador de digitação: intervalo mínimo entre transições por usuário e
+# expiração automática quando o cliente para de enviar 'typing'
+app.config['TYPING_THROTTLE_INTERVAL'] = float(os.environ.get('TYPING_THROTTLE_INTERVAL', 1.0))
+app.config['TYPING_TIMEOUT'] = float(os.environ.get('TYPING_TIMEOUT', 6.0))
+app.config['TYPING_TICK'] = float(os.environ.get('TYPING_TICK', 0.25))
+typing_indicator.init_app(app)
 
 # Registrar blueprints
 app.register_blueprint(auth_bp, url_prefix='/api')
@@ -50,6 +170,15 @@ app.register_blueprint(file_bp, url_prefix='/api')
 with app.app_context():
     db.create_all()
     
+    # Colunas e índices adicionados após a criação das tabelas em bancos existentes
+    added_columns = ensure_columns()
+    if added_columns:
+        print(f"🗂️  Colunas adicionadas: {', '.join(added_columns)}")
+        print("   Execute 'flask backfill-conversation-summary' para preencher os resumos das conversas")
+    created_indexes = ensure_indexes()
+    if created_indexes:
+        print(f"🗂️  Índices criados: {', '.join(created_indexes)}")
+    
     # Criar usuário admin padrão se não existir
     admin_user = User.query.filter_by(username='admin').first()
     if not admin_user:
@@ -91,6 +220,60 @@ with app.app_context():
     print("   - Admin: admin/admin123")
     print("   - Manager: manager/manager123")
 
+# Workers da fila do webhook (WEBHOOK_QUEUE_WORKERS=0 para drenar em um processo separado)
+webhook_queue.start()
+
+# Envios que ficaram 'pending' num processo que parou antes de concluí-los
+if app.config['OUTBOUND_RESUME']:
+    resumed = outbound_sender.resume_pending()
+    if resumed:
+        print(f"📤 {resumed} envio(s) pendente(s) reenfileirado(s)")
+
+@app.cli.command('ensure-indexes')
+def ensure_indexes_command():
+    """Criar os índices que ainda não existem no banco"""
+    with app.app_context():
+        created = ensure_indexes()
+    print(f"🗂️  Índices criados: {', '.join(created) if created else 'nenhum'}")
+
+@app.cli.command('backfill-conversation-summary')
+@click.option('--batch-size', default=10000, help='Conversas por transação')
+def backfill_conversation_summary_command(batch_size):
+    """Recalcular message_count e os campos da última mensagem de todas as conversas"""
+    with app.app_context():
+        updated = backfill_conversation_summaries(batch_size)
+    print(f"✅ {updated} conversas atualizadas")
+
+@app.cli.command('reconcile-attachments')
+@click.option('--batch-size', default=1000, help='Arquivos por transação')
+def reconcile_attachments_command(batch_size):
+    """Registrar na tabela de anexos os arquivos já existentes na pasta de uploads"""
+    with app.app_context():
+        imported, removed = reconcile_attachments(ALLOWED_EXTENSIONS, batch_size)
+    print(f"✅ {imported} arquivos importados, {removed} registros sem arquivo removidos")
+
+@app.cli.command('gc-uploads')
+def gc_uploads_command():
+    """Recolher uploads retomáveis abandonados, temporários antigos e blobs sem referência"""
+    ttl = app.config['RESUMABLE_UPLOAD_TTL']
+    with app.app_context():
+        sessions = expire_upload_sessions(ttl)
+    files = blob_store.collect_garbage(max_temp_age=ttl)
+    print(f"🧹 {sessions} sessões de upload expiradas, {files} arquivos removidos")
+
+@app.cli.command('webhook-worker')
+@click.option('--concurrency', default=2, help='Número de workers')
+def webhook_worker(concurrency):
+    """Drenar a fila do webhook em um processo dedicado"""
+    webhook_queue.start(concurrency)
+    print(f"📥 Drenando fila do webhook com {concurrency} workers")
+    try:
+        while True:
+            time.sleep(30)
+            print(f"📊 Fila do webhook: {webhook_queue.stats()}")
+    except KeyboardInterrupt:
+        webhook_queue.stop()
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
@@ -118,18 +301,45 @@ def serve(path):
 # Socket.IO events para # Socket.IO Events
 @socketio.on('connect')
 def handle_connect(auth):
+    """Autenticar a conexão uma vez pelo JWT e guardar o usuário na sessão do socket"""
+    token = (auth or {}).get('token') or request.headers.get('Authorization')
+    principal = principal_from_token(token)
+    if not principal:
+        raise ConnectionRefusedError('Token inválido')
+    attach_principal(request.sid, principal)
     print(f'Cliente conectado: {request.sid}')
     emit('connected', {'message': 'Conectado ao servidor'})
 
 @socketio.on('disconnect')
 def handle_disconnect():
+    typing_tracker.disconnect(request.sid)
+    detach_principal(request.sid)
     print(f'Cliente desconectado: {request.sid}')
 
+def payload_int(data, key):
+    """Inteiro enviado pelo cliente no payload de um evento; None se ausente ou inválido"""
+    value = data.get(key) if isinstance(data, dict) else None
+    if isinstance(value, bool):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
 @socketio.on('join_conversation')
 def handle_join_conversation(data):
     """Entrar em uma sala de conversa"""
-    conversation_id = data.get('conversation_id')
+    conversation_id = payload_int(data, 'conversation_id')
+    if conversation_id is None:
+        emit('join_error', {
+            'conversation_id': data.get('conversation_id') if isinstance(data, dict) else None,
+            'message': 'Identificador de conversa inválido'
+        })
+        return
     if conversation_id:
+        if not can_join_conversation(request.sid, conversation_id):
+            emit('join_error', {'conversation_id': conversation_id, 'message': 'Acesso negado a esta conversa'})
+            return
         join_room(f'conversation_{conversation_id}')
         emit('joined_conversation', {'conversation_id': conversation_id})
         print(f'Cliente {request.sid} entrou na conversa {conversation_id}')
@@ -143,41 +353,59 @@ def handle_leave_conversation(data):
         emit('left_conversation', {'conversation_id': conversation_id})
         print(f'Cliente {request.sid} saiu da conversa {conversation_id}')
 
+@socketio.on('subscribe_inbox')
+def handle_subscribe_inbox(data):
+    """Receber deltas da caixa de entrada, retomando a partir do último número de sequência"""
+    data = data if isinstance(data, dict) else {}
+    principal = socket_principal(request.sid)
+    
+    subscribed = inbox_rooms(principal)
+    for room in subscribed:
+        join_room(room)
+    
+    # Reenviar os deltas perdidos desde a última conexão
+    if data.get('since') is not None:
+        since = payload_int(data, 'since')
+        if since is None:
+            emit('inbox_resync', {'seq': latest_inbox_seq(), 'message': 'Número de sequência inválido'})
+            return
+        events = inbox_events_since(principal, since)
+        if events is None:
+            # Histórico insuficiente: o cliente deve recarregar GET /api/conversations
+            emit('inbox_resync', {'seq': latest_inbox_seq()})
+            return
+        for event in events:
+            emit('inbox_delta', event.to_dict())
+    
+    emit('inbox_subscribed', {'seq': latest_inbox_seq(), 'rooms': subscribed})
+
 @socketio.on('typing')
 def handle_typing(data):
     """Indicar que está digitando"""
-    conversation_id = data.get('conversation_id')
-    user_name = data.get('user_name')
-    if conversation_id and user_name:
-        emit('user_typing', {
-            'conversation_id': conversation_id,
-            'user_name': user_name
-        }, room=f'conversation_{conversation_id}', include_self=False)
+    conversation_id = payload_int(data, 'conversation_id')
+    if conversation_id and f'conversation_{conversation_id}' in rooms():
+        principal = socket_principal(request.sid)
+        typing_tracker.typing(request.sid, conversation_id, principal.id, principal.name)
 
 @socketio.on('stop_typing')
 def handle_stop_typing(data):
     """Parar de indicar que está digitando"""
-    conversation_id = data.get('conversation_id')
-    user_name = data.get('user_name')
-    if conversation_id and user_name:
-        emit('user_stop_typing', {
-            'conversation_id': conversation_id,
-            'user_name': user_name
-        }, room=f'conversation_{conversation_id}', include_self=False)
-
-def notify_new_message(conversation_id, message_data):
-    """Notificar nova mensagem via Socket.IO"""
-    socketio.emit('new_message', {
-        'conversation_id': conversation_id,
-        'message': message_data
-    }, room=f'conversation_{conversation_id}')
-
-def notify_conversation_transfer(conversation_id, transfer_data):
-    """Notificar transferência de conversa via Socket.IO"""
-    socketio.emit('conversation_transferred', {
-        'conversation_id': conversation_id,
-        'transfer': transfer_data
-    }, room=f'conversation_{conversation_id}')
+    conversation_id = payload_int(data, 'conversation_id')
+    if conversation_id:
+        typing_tracker.stop_typing(request.sid, conversation_id, socket_principal(request.sid).id)
+
+@app.route('/metrics', methods=['GET'])
+@limiter.exempt
+def prometheus_metrics():
+    """Métricas no formato do Prometheus (todos os workers do gunicorn)"""
+    return metrics.metrics_response()
+
+@app.route('/api/realtime/stats', methods=['GET'])
+@token_required
+@admin_required
+def realtime_stats(current_user):
+    """Obter filas de emissão e descartes por backpressure do Socket.IO neste processo"""
+    return jsonify(realtime.stats()), 200
 
 # Servir arquivos estáticos do React
 @app.route('/')
@@ -0,0 +1,86 @@
+from sqlalchemy import inspect, select, update, func, text
+from sqlalchemy.schema import CreateColumn
+from src.models.user import db, Conversation, Message, PREVIEW_LENGTH
+
+
+def ensure_columns(bind=None):
+    """Adicionar as colunas declaradas nos modelos que ainda não existem no banco
+
+    Cobre colunas novas em tabelas criadas por versões anteriores (o create_all()
+    não altera tabelas existentes). Retorna os nomes 'tabela.coluna' adicionados.
+    """
+    bind = bind or db.engine
+    inspector = inspect(bind)
+    added = []
+
+    with bind.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    spec = CreateColumn(column).compile(dialect=bind.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {spec}'))
+                    added.append(f'{table.name}.{column.name}')
+
+    return added
+
+
+def ensure_indexes(bind=None):
+    """Criar os índices declarados nos modelos que ainda não existem no banco
+
+    O create_all() só cria índices junto com tabelas novas; esta função cobre
+    bancos já existentes e pode ser executada a cada deploy. Retorna os nomes
+    dos índices criados.
+    """
+    bind = bind or db.engine
+    inspector = inspect(bind)
+    created = []
+
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda i: i.name):
+            if index.name not in existing:
+                index.create(bind, checkfirst=True)
+                created.append(index.name)
+
+    return created
+
+
+def backfill_conversation_summaries(batch_size=10000):
+    """Preencher message_count/last_message_* a partir da tabela de mensagens
+
+    Executa um UPDATE com subconsultas correlacionadas (que usam o índice
+    conversation_id + timestamp) em faixas de ids, com um commit por faixa.
+    Retorna o número de conversas atualizadas.
+    """
+    def latest(column):
+        return select(column).where(
+            Message.conversation_id == Conversation.id
+        ).order_by(Message.timestamp.desc(), Message.id.desc()).limit(1).scalar_subquery()
+
+    max_id = db.session.execute(select(func.max(Conversation.id))).scalar() or 0
+    updated = 0
+    for start in range(0, max_id, batch_size):
+        result = db.session.execute(
+            update(Conversation)
+            .where(Conversation.id > start, Conversation.id <= start + batch_size)
+            .values(
+                message_count=select(func.count(Message.id)).where(
+                    Message.conversation_id == Conversation.id
+                ).scalar_subquery(),
+                last_message_preview=latest(func.substr(Message.content, 1, PREVIEW_LENGTH)),
+                last_message_at=latest(Message.timestamp),
+                last_sender_type=latest(Message.sender_type),
+                # Não disparar o onupdate: a ordem da caixa de entrada não muda
+                updated_at=Conversation.updated_at,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        updated += result.rowcount
+
+    return updated
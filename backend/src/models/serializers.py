@@ -0,0 +1,57 @@
+from sqlalchemy import func
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy.orm.attributes import set_committed_value
+from src.models.user import db, User, Department
+
+
+def prefetch(rows, relationship, foreign_key, model):
+    """Carregar um relacionamento muitos-para-um de todas as linhas com uma única consulta IN"""
+    ids = {getattr(row, foreign_key) for row in rows} - {None}
+    
+    # Objetos já presentes na sessão não precisam ser consultados de novo
+    related = {}
+    for related_id in ids:
+        obj = db.session.identity_map.get(identity_key(model, related_id))
+        if obj is not None:
+            related[related_id] = obj
+    missing = ids - related.keys()
+    if missing:
+        related.update({obj.id: obj for obj in model.query.filter(model.id.in_(missing))})
+    
+    for row in rows:
+        set_committed_value(row, relationship, related.get(getattr(row, foreign_key)))
+    return rows
+
+
+def serialize_users(users):
+    prefetch(users, 'department', 'department_id', Department)
+    return [user.to_dict() for user in users]
+
+
+def serialize_departments(departments):
+    ids = [department.id for department in departments]
+    counts = dict(
+        db.session.query(User.department_id, func.count(User.id))
+        .filter(User.department_id.in_(ids))
+        .group_by(User.department_id)
+    ) if ids else {}
+    return [department.to_dict(user_count=counts.get(department.id, 0)) for department in departments]
+
+
+def serialize_conversations(conversations):
+    prefetch(conversations, 'department', 'department_id', Department)
+    prefetch(conversations, 'assigned_agent', 'assigned_agent_id', User)
+    return [conversation.to_dict() for conversation in conversations]
+
+
+def serialize_messages(messages):
+    prefetch(messages, 'sender', 'sender_id', User)
+    return [message.to_dict() for message in messages]
+
+
+def serialize_transfers(transfers):
+    prefetch(transfers, 'from_department', 'from_department_id', Department)
+    prefetch(transfers, 'to_department', 'to_department_id', Department)
+    prefetch(transfers, 'from_agent', 'from_agent_id', User)
+    prefetch(transfers, 'to_agent', 'to_agent_id', User)
+    return [transfer.to_dict() for transfer in transfers]
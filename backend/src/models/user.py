@@ -1,9 +1,13 @@
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from datetime import datetime, timezone
+import json
 import hashlib
 
 db = SQLAlchemy()
 
+# Tamanho do trecho da última mensagem guardado na conversa
+PREVIEW_LENGTH = 200
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -56,13 +60,13 @@ class Department(db.Model):
     transfers_from = db.relationship('Transfer', backref='from_department', foreign_keys='Transfer.from_department_id')
     transfers_to = db.relationship('Transfer', backref='to_department', foreign_keys='Transfer.to_department_id')
 
-    def to_dict(self):
+    def to_dict(self, user_count=None):
         return {
             'id': self.id,
             'name': self.name,
             'description': self.description,
             'is_active': self.is_active,
-            'user_count': len(self.users),
+            'user_count': len(self.users) if user_count is None else user_count,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
@@ -73,6 +77,8 @@ class WhatsAppConnection(db.Model):
     access_token = db.Column(db.String(500), nullable=False)
     webhook_verify_token = db.Column(db.String(100), nullable=False)
     business_account_id = db.Column(db.String(100), nullable=False)
+    # Id do número na Graph API (URL de envio); sem ele vale WHATSAPP_PHONE_ID
+    phone_number_id = db.Column(db.String(50), nullable=True)
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -82,6 +88,7 @@ class WhatsAppConnection(db.Model):
             'id': self.id,
             'phone_number': self.phone_number,
             'business_account_id': self.business_account_id,
+            'phone_number_id': self.phone_number_id,
             'is_active': self.is_active,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
@@ -98,10 +105,25 @@ class Conversation(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Resumo denormalizado, mantido a cada mensagem inserida
+    message_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_message_preview = db.Column(db.String(PREVIEW_LENGTH))
+    last_message_at = db.Column(db.DateTime)
+    last_sender_type = db.Column(db.String(20))
+    
     # Relacionamentos
     messages = db.relationship('Message', backref='conversation', cascade='all, delete-orphan')
     transfers = db.relationship('Transfer', backref='conversation', cascade='all, delete-orphan')
 
+    __table_args__ = (
+        # Roteamento de mensagens recebidas: conversa ativa de um contato
+        db.Index('ix_conversation_contact_status', 'whatsapp_contact_id', 'status'),
+        # Caixa de entrada: filtro por departamento/agente + status, ordenado por updated_at
+        db.Index('ix_conversation_department_status_updated', 'department_id', 'status', 'updated_at'),
+        db.Index('ix_conversation_agent_status_updated', 'assigned_agent_id', 'status', 'updated_at'),
+        db.Index('ix_conversation_status_updated', 'status', 'updated_at'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -113,11 +135,22 @@ class Conversation(db.Model):
             'assigned_agent_id': self.assigned_agent_id,
             'assigned_agent_name': self.assigned_agent.name if self.assigned_agent else None,
             'status': self.status,
-            'message_count': len(self.messages),
+            'message_count': self.message_count or 0,
+            'last_message_preview': self.last_message_preview,
+            'last_message_at': self.last_message_at.isoformat() if self.last_message_at else None,
+            'last_sender_type': self.last_sender_type,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
+    def record_messages(self, sender_type, content, timestamp, count=1):
+        """Atualizar o resumo após inserir `count` mensagens (a última com estes dados)"""
+        # Incremento no próprio UPDATE, seguro entre processos concorrentes
+        self.message_count = Conversation.message_count + count
+        self.last_message_preview = (content or '')[:PREVIEW_LENGTH]
+        self.last_message_at = timestamp
+        self.last_sender_type = sender_type
+
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False)
@@ -127,6 +160,21 @@ class Message(db.Model):
     message_type = db.Column(db.String(20), default='text')  # text, image, document, audio, system
     file_path = db.Column(db.String(500), nullable=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # Envio ao WhatsApp (mensagens de agentes): pending, sent, failed
+    delivery_status = db.Column(db.String(20), nullable=True)
+    whatsapp_message_id = db.Column(db.String(100), nullable=True)
+    delivery_error = db.Column(db.String(500), nullable=True)
+    # Quando o envio foi reenfileirado após um reinício (sem valor, vale timestamp)
+    delivery_queued_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        # Histórico de uma conversa em ordem cronológica
+        db.Index('ix_message_conversation_timestamp', 'conversation_id', 'timestamp'),
+        # wamid das mensagens recebidas e enviadas: a entrega do webhook é "pelo menos uma vez"
+        db.Index('ix_message_whatsapp_message_id', 'whatsapp_message_id', unique=True),
+        # Envios 'pending' procurados na inicialização
+        db.Index('ix_message_delivery_status', 'delivery_status'),
+    )
 
     def to_dict(self):
         return {
@@ -138,7 +186,74 @@ class Message(db.Model):
             'content': self.content,
             'message_type': self.message_type,
             'file_path': self.file_path,
-            'timestamp': self.timestamp.isoformat() if self.timestamp else None
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
+            'delivery_status': self.delivery_status
+        }
+
+class Attachment(db.Model):
+    """Arquivo enviado; file_path é o caminho público (o mesmo de Message.file_path)"""
+    id = db.Column(db.Integer, primary_key=True)
+    file_path = db.Column(db.String(500), unique=True, nullable=False)
+    file_type = db.Column(db.String(20), nullable=False)  # image, document, audio
+    file_size = db.Column(db.BigInteger, nullable=False)
+    sha256 = db.Column(db.String(64), nullable=False)
+    original_name = db.Column(db.String(255))
+    owner_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), nullable=True)
+    message_id = db.Column(db.Integer, db.ForeignKey('message.id', ondelete='SET NULL'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Listagens por dono e por tipo, mais recentes primeiro
+        db.Index('ix_attachment_owner_created', 'owner_id', 'created_at'),
+        db.Index('ix_attachment_type_created', 'file_type', 'created_at'),
+        db.Index('ix_attachment_created', 'created_at'),
+        db.Index('ix_attachment_sha256', 'sha256'),
+        db.Index('ix_attachment_message', 'message_id'),
+    )
+
+    def to_dict(self):
+        created_at = self.created_at.replace(tzinfo=timezone.utc).timestamp() if self.created_at else None
+        return {
+            'id': self.id,
+            'filename': self.file_path.rsplit('/', 1)[-1],
+            'relative_path': self.file_path,
+            'file_type': self.file_type,
+            'file_size': self.file_size,
+            'sha256': self.sha256,
+            'original_name': self.original_name,
+            'owner_id': self.owner_id,
+            'message_id': self.message_id,
+            # Epoch em segundos, como o st_ctime/st_mtime devolvidos antes da listagem vir
+            # do banco; um upload nunca é reescrito, então as duas datas coincidem
+            'created_at': created_at,
+            'modified_at': created_at
+        }
+
+class UploadSession(db.Model):
+    """Upload retomável em andamento; os bytes recebidos ficam em blobs/tmp/<id>.upload"""
+    id = db.Column(db.String(32), primary_key=True)
+    owner_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    original_name = db.Column(db.String(255), nullable=False)
+    file_type = db.Column(db.String(20), nullable=False)
+    total_size = db.Column(db.BigInteger, nullable=False)
+    received = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # Coleta das sessões abandonadas
+        db.Index('ix_upload_session_updated', 'updated_at'),
+    )
+
+    def to_dict(self):
+        return {
+            'upload_id': self.id,
+            'original_name': self.original_name,
+            'file_type': self.file_type,
+            'size': self.total_size,
+            'offset': self.received,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
 class Transfer(db.Model):
@@ -153,6 +268,10 @@ class Transfer(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_transfer_conversation_created', 'conversation_id', 'created_at'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -171,3 +290,35 @@ class Transfer(db.Model):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
+
+class InboxEvent(db.Model):
+    """Delta da caixa de entrada; o id é o número de sequência usado na retomada"""
+    id = db.Column(db.Integer, primary_key=True)
+    op = db.Column(db.String(20), nullable=False)  # created, updated, moved, closed
+    conversation_id = db.Column(db.Integer, nullable=False)
+    department_id = db.Column(db.Integer, nullable=True)
+    assigned_agent_id = db.Column(db.Integer, nullable=True)
+    from_department_id = db.Column(db.Integer, nullable=True)
+    from_agent_id = db.Column(db.Integer, nullable=True)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def rooms(self):
+        """Salas Socket.IO que devem receber o delta"""
+        rooms = {'inbox_all'}
+        for department_id in (self.department_id, self.from_department_id):
+            if department_id:
+                rooms.add(f'department_{department_id}')
+        for agent_id in (self.assigned_agent_id, self.from_agent_id):
+            if agent_id:
+                rooms.add(f'agent_{agent_id}')
+        return sorted(rooms)
+
+    def to_dict(self):
+        return {
+            'seq': self.id,
+            'op': self.op,
+            'conversation': json.loads(self.payload),
+            'from_department_id': self.from_department_id,
+            'from_agent_id': self.from_agent_id
+        }
@@ -1,16 +1,87 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_cors import CORS
 import jwt
 import hashlib
+import time
+from collections import namedtuple
 from datetime import datetime, timedelta
 from functools import wraps
 from src.models.user import db, User, Department
+from src.services.cache import LRUCache
 
 auth_bp = Blueprint('auth', __name__)
 CORS(auth_bp)
 
 JWT_SECRET = 'your-secret-key-change-in-production'
 
+# Campos do usuário autenticado usados pelas rotas (imutável, pode ser compartilhado entre threads)
+Principal = namedtuple('Principal', ['id', 'username', 'name', 'role', 'department_id', 'is_active'])
+
+# user_id -> Principal, por processo
+principal_cache = LRUCache(maxsize=10000)
+
+# user_id -> instante da última alteração; claims emitidas antes disso não são confiáveis
+principal_revoked_at = {}
+
+def principal_from_user(user):
+    return Principal(user.id, user.username, user.name, user.role, user.department_id, user.is_active)
+
+def resolve_principal(claims):
+    """Resolver o usuário do token: claims assinadas recentes, cache do processo ou banco"""
+    user_id = claims['user_id']
+    
+    # Confiar nas claims assinadas por uma janela curta após a emissão do token
+    trust_window = current_app.config.get('AUTH_TRUST_CLAIMS_SECONDS', 0)
+    issued_at = claims.get('iat')
+    if trust_window and issued_at and 'department_id' in claims:
+        if time.time() - issued_at <= trust_window and issued_at > principal_revoked_at.get(user_id, 0):
+            return Principal(user_id, claims['username'], claims.get('name'), claims['role'],
+                             claims['department_id'], True)
+    
+    principal = principal_cache.get(user_id)
+    if principal is None:
+        user = User.query.get(user_id)
+        if not user:
+            return None
+        principal = principal_from_user(user)
+        ttl = current_app.config.get('AUTH_CACHE_TTL', 30)
+        if ttl:
+            principal_cache.set(user_id, principal, ttl=ttl)
+    return principal
+
+def principal_from_token(token):
+    """Validar um JWT fora das rotas HTTP (ex.: Socket.IO); retorna o Principal ou None"""
+    if not token:
+        return None
+    if token.startswith('Bearer '):
+        token = token[7:]
+    try:
+        principal = resolve_principal(jwt.decode(token, JWT_SECRET, algorithms=['HS256']))
+    except jwt.InvalidTokenError:
+        return None
+    if not principal or not principal.is_active:
+        return None
+    return principal
+
+def invalidate_principal(user_id):
+    """Descartar o usuário do cache após alteração ou remoção"""
+    principal_cache.delete(user_id)
+    principal_revoked_at[user_id] = time.time()
+
+def generate_token(user):
+    """Gerar token JWT com as claims usadas na autorização"""
+    now = datetime.utcnow()
+    payload = {
+        'user_id': user.id,
+        'username': user.username,
+        'name': user.name,
+        'role': user.role,
+        'department_id': user.department_id,
+        'iat': now,
+        'exp': now + timedelta(hours=24)
+    }
+    return jwt.encode(payload, JWT_SECRET, algorithm='HS256')
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -22,7 +93,7 @@ def token_required(f):
             if token.startswith('Bearer '):
                 token = token[7:]
             data = jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
-            current_user = User.query.get(data['user_id'])
+            current_user = resolve_principal(data)
             if not current_user or not current_user.is_active:
                 return jsonify({'message': 'Token inválido'}), 401
         except jwt.ExpiredSignatureError:
@@ -60,13 +131,7 @@ def login():
             return jsonify({'message': 'Usuário inativo'}), 401
         
         # Gerar token JWT
-        payload = {
-            'user_id': user.id,
-            'username': user.username,
-            'role': user.role,
-            'exp': datetime.utcnow() + timedelta(hours=24)
-        }
-        token = jwt.encode(payload, JWT_SECRET, algorithm='HS256')
+        token = generate_token(user)
         
         return jsonify({
             'message': 'Login realizado com sucesso',
@@ -85,7 +150,15 @@ def logout(current_user):
 @auth_bp.route('/me', methods=['GET'])
 @token_required
 def get_current_user(current_user):
-    return jsonify({'user': current_user.to_dict()}), 200
+    user = User.query.get(current_user.id)
+    return jsonify({'user': user.to_dict()}), 200
+
+@auth_bp.route('/token/refresh', methods=['POST'])
+@token_required
+def refresh_token(current_user):
+    """Emitir um novo token com claims atualizadas"""
+    user = User.query.get(current_user.id)
+    return jsonify({'token': generate_token(user)}), 200
 
 @auth_bp.route('/health', methods=['GET'])
 def health_check():
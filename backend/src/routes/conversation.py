@@ -1,12 +1,25 @@
 from flask import Blueprint, request, jsonify
 from flask_cors import CORS
-from src.models.user import db, Conversation, Message, Transfer, Department, User
+from src.models.user import db, Attachment, Conversation, Message, Transfer, Department, User, WhatsAppConnection
+from src.models.serializers import serialize_conversations, serialize_messages, serialize_transfers
 from src.routes.auth import token_required
+from src.services.conversation_routing import invalidate_contact
+from src.services.outbound import outbound_sender, QueueFull, NotConfigured
+from src.services.realtime import notify_new_message, notify_conversation_transfer, notify_conversation_status
+from src.services.inbox import record_inbox_event, publish_inbox_events
+from src.services.room_acl import can_access_conversation, invalidate_conversation_acl
+from sqlalchemy import tuple_, update
 from datetime import datetime
+import base64
+import binascii
 
 conversation_bp = Blueprint('conversation', __name__)
 CORS(conversation_bp)
 
+# Tamanho das páginas do histórico de mensagens
+MESSAGE_PAGE_SIZE = 50
+MAX_MESSAGE_PAGE_SIZE = 200
+
 @conversation_bp.route('/conversations', methods=['GET'])
 @token_required
 def get_conversations(current_user):
@@ -16,23 +29,31 @@ def get_conversations(current_user):
         per_page = request.args.get('per_page', 10, type=int)
         status = request.args.get('status', 'open')
         
-        # Filtrar conversas baseado no role do usuário
-        query = Conversation.query
-        
-        if current_user.role == 'agent':
-            # Agentes veem apenas suas conversas ou do seu departamento
-            query = query.filter(
-                (Conversation.assigned_agent_id == current_user.id) |
-                (Conversation.department_id == current_user.department_id)
-            )
-        elif current_user.role == 'manager':
-            # Gerenciadores veem conversas do seu departamento
-            if current_user.department_id:
-                query = query.filter(Conversation.department_id == current_user.department_id)
-        # Admins veem todas as conversas
-        
-        if status != 'all':
-            query = query.filter(Conversation.status == status)
+        query = inbox_query(current_user, status)
+        
+        # Modo cursor (opt-in): paginação por (updated_at, id), sem COUNT(*)
+        if 'cursor' in request.args:
+            cursor = request.args.get('cursor')
+            if cursor:
+                try:
+                    updated_at, last_id = decode_cursor(cursor)
+                except ValueError:
+                    return jsonify({'message': 'Cursor inválido'}), 400
+                query = query.filter(
+                    tuple_(Conversation.updated_at, Conversation.id) < (updated_at, last_id)
+                )
+            
+            rows = query.order_by(
+                Conversation.updated_at.desc(), Conversation.id.desc()
+            ).limit(per_page + 1).all()
+            has_more = len(rows) > per_page
+            rows = rows[:per_page]
+            
+            return jsonify({
+                'conversations': serialize_conversations(rows),
+                'next_cursor': encode_cursor(rows[-1]) if has_more else None,
+                'has_more': has_more
+            }), 200
         
         conversations = query.order_by(Conversation.updated_at.desc()).paginate(
             page=page, 
@@ -41,7 +62,7 @@ def get_conversations(current_user):
         )
         
         return jsonify({
-            'conversations': [conv.to_dict() for conv in conversations.items],
+            'conversations': serialize_conversations(conversations.items),
             'total': conversations.total,
             'pages': conversations.pages,
             'current_page': page
@@ -63,19 +84,58 @@ def get_conversation(current_user, conversation_id):
         if not can_access_conversation(current_user, conversation):
             return jsonify({'message': 'Acesso negado'}), 403
         
-        # Buscar mensagens da conversa
-        messages = Message.query.filter_by(
-            conversation_id=conversation_id
-        ).order_by(Message.timestamp.asc()).all()
+        # Histórico completo, a menos que o cliente peça uma janela com ?limit=
+        # (o frontend ainda não busca as páginas anteriores em /messages?before=)
+        limit = request.args.get('limit', type=int)
+        if limit:
+            limit = max(1, min(limit, MAX_MESSAGE_PAGE_SIZE))
+        messages, has_more = message_history(conversation_id, limit=limit)
         
         return jsonify({
             'conversation': conversation.to_dict(),
-            'messages': [msg.to_dict() for msg in messages]
+            'messages': serialize_messages(messages),
+            'has_more_messages': has_more
         }), 200
         
     except Exception as e:
         return jsonify({'message': f'Erro ao buscar conversa: {str(e)}'}), 500
 
+@conversation_bp.route('/conversations/<int:conversation_id>/messages', methods=['GET'])
+@token_required
+def get_messages(current_user, conversation_id):
+    """Histórico paginado de mensagens (cursores before/after por id de mensagem)"""
+    try:
+        conversation = Conversation.query.get(conversation_id)
+        if not conversation:
+            return jsonify({'message': 'Conversa não encontrada'}), 404
+        
+        # Verificar permissão
+        if not can_access_conversation(current_user, conversation):
+            return jsonify({'message': 'Acesso negado'}), 403
+        
+        before = request.args.get('before', type=int)
+        after = request.args.get('after', type=int)
+        limit = request.args.get('limit', MESSAGE_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, MAX_MESSAGE_PAGE_SIZE))
+        
+        if before and after:
+            return jsonify({'message': 'Use apenas um dos parâmetros before ou after'}), 400
+        
+        try:
+            messages, has_more = message_history(conversation_id, before=before, after=after, limit=limit)
+        except LookupError:
+            return jsonify({'message': 'Mensagem de referência não encontrada'}), 400
+        
+        return jsonify({
+            'messages': serialize_messages(messages),
+            'has_more': has_more,
+            'before_cursor': messages[0].id if messages else None,
+            'after_cursor': messages[-1].id if messages else None
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'message': f'Erro ao buscar mensagens: {str(e)}'}), 500
+
 @conversation_bp.route('/conversations/<int:conversation_id>/messages', methods=['POST'])
 @token_required
 def send_message(current_user, conversation_id):
@@ -100,20 +160,55 @@ def send_message(current_user, conversation_id):
             sender_id=current_user.id,
             content=data['content'],
             message_type=data.get('message_type', 'text'),
-            file_path=data.get('file_path')
+            file_path=data.get('file_path'),
+            timestamp=datetime.utcnow()
         )
         
         db.session.add(new_message)
         
         # Atualizar conversa
-        conversation.updated_at = datetime.utcnow()
-        if not conversation.assigned_agent_id:
+        conversation.updated_at = new_message.timestamp
+        conversation.record_messages('agent', new_message.content, new_message.timestamp)
+        assigned = not conversation.assigned_agent_id
+        if assigned:
             conversation.assigned_agent_id = current_user.id
         
+        # Enviar ao cliente pelo WhatsApp, se houver conexão ativa
+        connection = WhatsAppConnection.query.filter_by(is_active=True).first()
+        if connection:
+            try:
+                outbound_sender.phone_number_id(connection)
+                new_message.delivery_status = 'pending'
+            except NotConfigured as e:
+                new_message.delivery_status = 'failed'
+                new_message.delivery_error = str(e)
+                connection = None
+        
+        inbox_event = record_inbox_event('updated', conversation)
+        if new_message.file_path:
+            # Vincular o anexo enviado antes (a mensagem já tem id após o flush acima)
+            db.session.execute(
+                update(Attachment)
+                .where(Attachment.file_path == new_message.file_path, Attachment.message_id.is_(None))
+                .values(message_id=new_message.id)
+            )
         db.session.commit()
-        
-        # Aqui você pode adicionar lógica para enviar via WhatsApp
-        # send_whatsapp_message(conversation.contact_phone, data['content'])
+        if assigned:
+            invalidate_conversation_acl(conversation)
+        
+        if connection:
+            try:
+                outbound_sender.send_text(
+                    new_message.id, connection,
+                    conversation.contact_phone or conversation.whatsapp_contact_id, new_message.content
+                )
+            except QueueFull:
+                new_message.delivery_status = 'failed'
+                new_message.delivery_error = 'Fila de envio cheia'
+                db.session.commit()
+        
+        notify_new_message(conversation_id, new_message.to_dict())
+        publish_inbox_events([inbox_event])
         
         return jsonify({
             'message': 'Mensagem enviada com sucesso',
@@ -124,6 +219,28 @@ def send_message(current_user, conversation_id):
         db.session.rollback()
         return jsonify({'message': f'Erro ao enviar mensagem: {str(e)}'}), 500
 
+@conversation_bp.route('/conversations/<int:conversation_id>/transfers', methods=['GET'])
+@token_required
+def get_transfers(current_user, conversation_id):
+    """Histórico de transferências de uma conversa"""
+    try:
+        conversation = Conversation.query.get(conversation_id)
+        if not conversation:
+            return jsonify({'message': 'Conversa não encontrada'}), 404
+        
+        # Verificar permissão
+        if not can_access_conversation(current_user, conversation):
+            return jsonify({'message': 'Acesso negado'}), 403
+        
+        transfers = Transfer.query.filter_by(
+            conversation_id=conversation_id
+        ).order_by(Transfer.created_at.desc()).all()
+        
+        return jsonify({'transfers': serialize_transfers(transfers)}), 200
+        
+    except Exception as e:
+        return jsonify({'message': f'Erro ao buscar transferências: {str(e)}'}), 500
+
 @conversation_bp.route('/conversations/<int:conversation_id>/transfer', methods=['POST'])
 @token_required
 def transfer_conversation(current_user, conversation_id):
@@ -171,6 +288,7 @@ def transfer_conversation(current_user, conversation_id):
         db.session.add(transfer)
         
         # Atualizar conversa
+        from_agent_id = conversation.assigned_agent_id
         conversation.department_id = to_department_id
         conversation.assigned_agent_id = to_agent_id
         conversation.status = 'transferred'
@@ -181,18 +299,28 @@ def transfer_conversation(current_user, conversation_id):
             conversation_id=conversation_id,
             sender_type='system',
             content=f'Conversa transferida de {conversation.department.name} para {to_department.name}. Motivo: {reason}',
-            message_type='system'
+            message_type='system',
+            timestamp=conversation.updated_at
         )
         
         db.session.add(system_message)
+        conversation.record_messages('system', system_message.content, system_message.timestamp)
+        inbox_event = record_inbox_event(
+            'moved', conversation,
+            from_department_id=transfer.from_department_id, from_agent_id=from_agent_id
+        )
         db.session.commit()
+        invalidate_contact(conversation.whatsapp_contact_id)
+        invalidate_conversation_acl(conversation)
         
-        # Aqui você pode adicionar notificação via Socket.IO
-        # notify_transfer(conversation_id, to_department_id, to_agent_id)
+        transfer_data = transfer.to_dict()
+        notify_new_message(conversation_id, system_message.to_dict())
+        notify_conversation_transfer(conversation_id, transfer_data)
+        publish_inbox_events([inbox_event])
         
         return jsonify({
             'message': 'Conversa transferida com sucesso',
-            'transfer': transfer.to_dict()
+            'transfer': transfer_data
         }), 200
         
     except Exception as e:
@@ -220,11 +348,19 @@ def close_conversation(current_user, conversation_id):
             conversation_id=conversation_id,
             sender_type='system',
             content=f'Conversa fechada por {current_user.name}',
-            message_type='system'
+            message_type='system',
+            timestamp=conversation.updated_at
         )
         
         db.session.add(system_message)
+        conversation.record_messages('system', system_message.content, system_message.timestamp)
+        inbox_event = record_inbox_event('closed', conversation)
         db.session.commit()
+        invalidate_contact(conversation.whatsapp_contact_id)
+        
+        notify_new_message(conversation_id, system_message.to_dict())
+        notify_conversation_status(conversation_id, 'closed')
+        publish_inbox_events([inbox_event])
         
         return jsonify({'message': 'Conversa fechada com sucesso'}), 200
         
@@ -253,11 +389,19 @@ def reopen_conversation(current_user, conversation_id):
             conversation_id=conversation_id,
             sender_type='system',
             content=f'Conversa reaberta por {current_user.name}',
-            message_type='system'
+            message_type='system',
+            timestamp=conversation.updated_at
         )
         
         db.session.add(system_message)
+        conversation.record_messages('system', system_message.content, system_message.timestamp)
+        inbox_event = record_inbox_event('updated', conversation)
         db.session.commit()
+        invalidate_contact(conversation.whatsapp_contact_id)
+        
+        notify_new_message(conversation_id, system_message.to_dict())
+        notify_conversation_status(conversation_id, 'open')
+        publish_inbox_events([inbox_event])
         
         return jsonify({'message': 'Conversa reaberta com sucesso'}), 200
         
@@ -265,14 +409,70 @@ def reopen_conversation(current_user, conversation_id):
         db.session.rollback()
         return jsonify({'message': f'Erro ao reabrir conversa: {str(e)}'}), 500
 
-def can_access_conversation(user, conversation):
-    """Verificar se o usuário pode acessar a conversa"""
-    if user.role == 'admin':
-        return True
+def encode_cursor(conversation):
+    """Cursor opaco a partir da última conversa de uma página"""
+    raw = f'{conversation.updated_at.isoformat()}|{conversation.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Decodificar um cursor em (updated_at, id); ValueError se for inválido"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        updated_at, conversation_id = raw.split('|')
+        return datetime.fromisoformat(updated_at), int(conversation_id)
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError(str(e))
+
+def message_history(conversation_id, before=None, after=None, limit=MESSAGE_PAGE_SIZE):
+    """Janela do histórico em ordem cronológica; retorna (mensagens, has_more)
+
+    Sem cursor retorna as últimas `limit` mensagens (todas, com limit=None);
+    `before`/`after` são ids de mensagens da própria conversa e has_more indica
+    se há mais mensagens na direção pedida.
+    """
+    query = Message.query.filter(Message.conversation_id == conversation_id)
+    if limit is None and not (before or after):
+        return query.order_by(Message.timestamp.asc(), Message.id.asc()).all(), False
+    key = tuple_(Message.timestamp, Message.id)
+    
+    anchor_id = before or after
+    if anchor_id:
+        anchor = Message.query.filter_by(id=anchor_id, conversation_id=conversation_id).first()
+        if not anchor:
+            raise LookupError(anchor_id)
+        anchor_key = (anchor.timestamp, anchor.id)
+    
+    if after:
+        rows = query.filter(key > anchor_key).order_by(
+            Message.timestamp.asc(), Message.id.asc()
+        ).limit(limit + 1).all()
+        return rows[:limit], len(rows) > limit
+    
+    if before:
+        query = query.filter(key < anchor_key)
+    rows = query.order_by(
+        Message.timestamp.desc(), Message.id.desc()
+    ).limit(limit + 1).all()
+    return list(reversed(rows[:limit])), len(rows) > limit
+
+def inbox_query(user, status='open'):
+    """Consulta da caixa de entrada filtrada pelo role do usuário"""
+    query = Conversation.query
+    
+    if user.role == 'agent':
+        # Agentes veem apenas suas conversas ou do seu departamento
+        query = query.filter(
+            (Conversation.assigned_agent_id == user.id) |
+            (Conversation.department_id == user.department_id)
+        )
     elif user.role == 'manager':
-        return user.department_id == conversation.department_id
-    elif user.role == 'agent':
-        return (user.id == conversation.assigned_agent_id or 
-                user.department_id == conversation.department_id)
-    return False
+        # Gerenciadores veem conversas do seu departamento
+        if user.department_id:
+            query = query.filter(Conversation.department_id == user.department_id)
+    # Admins veem todas as conversas
+    
+    if status != 'all':
+        query = query.filter(Conversation.status == status)
+    
+    return query
 
@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify
 from flask_cors import CORS
 from src.models.user import db, Department
+from src.models.serializers import serialize_departments
 from src.routes.auth import token_required, admin_required
 
 department_bp = Blueprint('department', __name__)
@@ -12,7 +13,7 @@ def get_departments(current_user):
     try:
         departments = Department.query.filter_by(is_active=True).all()
         return jsonify({
-            'departments': [dept.to_dict() for dept in departments]
+            'departments': serialize_departments(departments)
         }), 200
         
     except Exception as e:
@@ -1,21 +1,38 @@
-from flask import Blueprint, request, jsonify, send_from_directory
+from flask import Blueprint, Response, current_app, request, jsonify, send_file
 from flask_cors import CORS
+from src.models.user import db, Attachment, UploadSession
 from src.routes.auth import token_required
+from src.services.metrics import upload_bytes
+from src.services.blob_store import blob_store, file_digest, FileTooLarge, CHUNK_SIZE
+from src.services.attachments import record_attachment, upload_session_path, expire_upload_sessions
+from src.services.thumbnails import thumbnail_pool, PREVIEW_SIZES
+import mimetypes
 import os
+import posixpath
 import uuid
+from datetime import datetime
+from urllib.parse import quote
+from sqlalchemy import update
+from werkzeug.exceptions import ClientDisconnected
+from werkzeug.formparser import parse_form_data
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
 
 file_bp = Blueprint('file', __name__)
 CORS(file_bp)
 
 # Configurações de upload
-UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), '..', 'uploads')
+UPLOAD_FOLDER = blob_store.root
 ALLOWED_EXTENSIONS = {
     'image': {'png', 'jpg', 'jpeg', 'gif', 'webp'},
     'document': {'pdf', 'doc', 'docx', 'txt', 'xls', 'xlsx'},
     'audio': {'mp3', 'wav', 'ogg', 'm4a'}
 }
 MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB
+# Folga para os cabeçalhos do multipart na checagem do Content-Length
+MULTIPART_OVERHEAD = 64 * 1024
+FILES_PAGE_SIZE = 50
+MAX_FILES_PAGE_SIZE = 200
 
 # Criar diretório de uploads se não existir
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -33,90 +50,215 @@ def allowed_file(filename):
     
     return False, None
 
-def get_file_size(file):
-    """Obter tamanho do arquivo"""
-    file.seek(0, os.SEEK_END)
-    size = file.tell()
-    file.seek(0)
-    return size
+def file_too_large():
+    return jsonify({'message': f'Arquivo muito grande. Máximo: {MAX_FILE_SIZE // (1024*1024)}MB'}), 400
 
 @file_bp.route('/upload', methods=['POST'])
 @token_required
 def upload_file(current_user):
-    """Upload de arquivo"""
+    """Upload de arquivo (gravado em disco durante a recepção, deduplicado pelo SHA-256)"""
+    if request.content_length and request.content_length > MAX_FILE_SIZE + MULTIPART_OVERHEAD:
+        return file_too_large()
+    
+    writers = []
+    
+    def stream_factory(total_content_length, content_type, filename, content_length=None):
+        writer = blob_store.writer(MAX_FILE_SIZE)
+        writers.append(writer)
+        return writer
+    
     try:
-        if 'file' not in request.files:
+        try:
+            _, _, files = parse_form_data(request.environ, stream_factory=stream_factory)
+        except FileTooLarge:
+            # Recepção interrompida assim que o limite foi ultrapassado
+            return file_too_large()
+        
+        if 'file' not in files:
             return jsonify({'message': 'Nenhum arquivo enviado'}), 400
         
-        file = request.files['file']
+        file = files['file']
         if file.filename == '':
             return jsonify({'message': 'Nenhum arquivo selecionado'}), 400
         
-        # Verificar tamanho do arquivo
-        file_size = get_file_size(file)
-        if file_size > MAX_FILE_SIZE:
-            return jsonify({'message': f'Arquivo muito grande. Máximo: {MAX_FILE_SIZE // (1024*1024)}MB'}), 400
-        
         # Verificar tipo de arquivo
         is_allowed, file_type = allowed_file(file.filename)
         if not is_allowed:
             return jsonify({'message': 'Tipo de arquivo não permitido'}), 400
         
-        # Gerar nome único para o arquivo
-        file_extension = file.filename.rsplit('.', 1)[1].lower()
-        unique_filename = f"{uuid.uuid4().hex}.{file_extension}"
-        
-        # Criar subdiretório por tipo
-        type_folder = os.path.join(UPLOAD_FOLDER, file_type)
-        os.makedirs(type_folder, exist_ok=True)
-        
-        # Salvar arquivo
-        file_path = os.path.join(type_folder, unique_filename)
-        file.save(file_path)
-        
-        # Caminho relativo para armazenar no banco
-        relative_path = os.path.join(file_type, unique_filename)
-        
-        return jsonify({
-            'message': 'Arquivo enviado com sucesso',
-            'file_path': relative_path,
-            'file_type': file_type,
-            'file_size': file_size,
-            'original_name': secure_filename(file.filename)
-        }), 200
+        # Publicar: um hard link para o blob do conteúdo (gravado só se for inédito)
+        writer = file.stream
+        relative_path = new_file_path(file.filename, file_type)
+        blob_store.commit(writer, relative_path)
+        return register_upload(current_user, relative_path, file_type, writer.size, writer.digest, file.filename)
         
     except Exception as e:
         return jsonify({'message': f'Erro ao fazer upload: {str(e)}'}), 500
+    finally:
+        # Partes não publicadas (erro, tipo inválido, campos extras)
+        for writer in writers:
+            writer.discard()
+
+def new_file_path(filename, file_type):
+    """Nome único para o arquivo, no subdiretório do tipo"""
+    file_extension = filename.rsplit('.', 1)[1].lower()
+    return os.path.join(file_type, f"{uuid.uuid4().hex}.{file_extension}")
+
+def register_upload(current_user, relative_path, file_type, file_size, sha256, original_name):
+    """Registrar o arquivo já publicado e montar a resposta do upload"""
+    try:
+        record_attachment(relative_path, file_type, file_size, sha256,
+                          original_name=secure_filename(original_name), owner_id=current_user.id)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        blob_store.release(relative_path, sha256)
+        raise
+    upload_bytes.labels(file_type).inc(file_size)
+    thumbnail_pool.submit(sha256, relative_path)
+    
+    return jsonify({
+        'message': 'Arquivo enviado com sucesso',
+        'file_path': relative_path,
+        'file_type': file_type,
+        'file_size': file_size,
+        'sha256': sha256,
+        'original_name': secure_filename(original_name)
+    }), 200
 
 @file_bp.route('/files/<path:filename>', methods=['GET'])
 @token_required
 def download_file(current_user, filename):
-    """Download de arquivo"""
+    """Download de arquivo (ETag, Range e cache; opcionalmente entregue pelo proxy)"""
     try:
         # Verificar se o arquivo existe
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
-        if not os.path.exists(file_path):
+        file_path = public_file_path(filename)
+        if not file_path:
             return jsonify({'message': 'Arquivo não encontrado'}), 404
         
-        # Obter diretório e nome do arquivo
-        directory = os.path.dirname(file_path)
-        basename = os.path.basename(file_path)
+        # Arquivos registrados têm nome único e conteúdo imutável: o SHA-256 é a ETag
+        attachment = Attachment.query.filter_by(file_path=filename).first()
+        download_name = (attachment.original_name if attachment else None) or os.path.basename(file_path)
         
-        return send_from_directory(directory, basename, as_attachment=True)
+        if current_app.config.get('FILE_DELIVERY') == 'x-accel':
+            response = accel_redirect(filename, download_name, attachment)
+        else:
+            # conditional=True: If-None-Match/If-Modified-Since (304), Range e If-Range (206)
+            response = send_file(
+                file_path,
+                as_attachment=True,
+                download_name=download_name,
+                conditional=True,
+                etag=attachment.sha256 if attachment else True
+            )
+        
+        if attachment:
+            response.cache_control.no_cache = None
+            response.cache_control.private = True
+            response.cache_control.max_age = current_app.config.get('FILE_CACHE_MAX_AGE', 31536000)
+            response.cache_control.immutable = True
+        return response
         
     except Exception as e:
         return jsonify({'message': f'Erro ao baixar arquivo: {str(e)}'}), 500
 
+@file_bp.route('/files/<path:filename>/preview', methods=['GET'])
+@token_required
+def preview_file(current_user, filename):
+    """Miniatura/prévia (size=thumb, small ou large); imagens usam o original enquanto a prévia é gerada"""
+    try:
+        size = request.args.get('size', 'small')
+        if size not in PREVIEW_SIZES:
+            return jsonify({'message': f"Tamanho inválido. Use: {', '.join(PREVIEW_SIZES)}"}), 400
+        
+        file_path = public_file_path(filename)
+        if not file_path:
+            return jsonify({'message': 'Arquivo não encontrado'}), 404
+        
+        attachment = Attachment.query.filter_by(file_path=filename).first()
+        if attachment:
+            preview_path = thumbnail_pool.preview_path(attachment.sha256, size)
+            if os.path.exists(preview_path):
+                response = send_file(
+                    preview_path, mimetype='image/jpeg', conditional=True, etag=f'{attachment.sha256}-{size}'
+                )
+                response.cache_control.no_cache = None
+                response.cache_control.private = True
+                response.cache_control.max_age = current_app.config.get('FILE_CACHE_MAX_AGE', 31536000)
+                response.cache_control.immutable = True
+                return response
+            
+            # Sem prévia ainda (upload anterior, reinício do processo): gerar agora
+            pending = thumbnail_pool.submit(attachment.sha256, filename)
+        else:
+            pending = False
+        
+        status = 'pending' if pending else 'unavailable'
+        if filename.rsplit('.', 1)[-1].lower() in ALLOWED_EXTENSIONS['image']:
+            response = send_file(file_path, conditional=True)
+            response.cache_control.no_cache = True
+            response.headers['X-Preview-Status'] = status
+            return response
+        
+        if pending:
+            response = jsonify({'status': status})
+            response.status_code = 202
+            response.headers['Retry-After'] = '2'
+            return response
+        return jsonify({'message': 'Pré-visualização indisponível', 'status': status}), 404
+        
+    except Exception as e:
+        return jsonify({'message': f'Erro ao obter pré-visualização: {str(e)}'}), 500
+
+def public_file_path(filename):
+    """Caminho absoluto de um arquivo público; None se não existir ou estiver fora das pastas públicas"""
+    # Só a forma canônica: o nome também é usado como chave do Attachment e no X-Accel-Redirect
+    if posixpath.normpath(filename) != filename:
+        return None
+    file_path = safe_join(UPLOAD_FOLDER, filename)
+    if not file_path or not os.path.isfile(file_path):
+        return None
+    # Blobs, temporários e prévias não são acessíveis pelo caminho público
+    real_path = os.path.realpath(file_path)
+    for private_dir in (blob_store.blob_root, thumbnail_pool.root):
+        private_dir = os.path.realpath(private_dir)
+        if os.path.commonpath([real_path, private_dir]) == private_dir:
+            return None
+    return file_path
+
+def accel_redirect(filename, download_name, attachment):
+    """Resposta vazia com X-Accel-Redirect: o nginx envia os bytes (e atende Range) após a autenticação
+    
+    Requer uma location interna apontando para a pasta de uploads, por exemplo:
+    
+        location /protected-uploads/ { internal; alias /app/src/uploads/; }
+    """
+    if attachment and request.if_none_match.contains(attachment.sha256):
+        response = Response(status=304)
+        response.set_etag(attachment.sha256)
+        return response
+    
+    response = Response(mimetype=mimetypes.guess_type(download_name)[0] or 'application/octet-stream')
+    response.headers['X-Accel-Redirect'] = current_app.config.get('FILE_ACCEL_PREFIX', '/protected-uploads/') + quote(filename)
+    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(download_name)}"
+    if attachment:
+        response.set_etag(attachment.sha256)
+    return response
+
 @file_bp.route('/files/<path:filename>/info', methods=['GET'])
 @token_required
 def get_file_info(current_user, filename):
     """Obter informações do arquivo"""
     try:
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
-        if not os.path.exists(file_path):
+        attachment = Attachment.query.filter_by(file_path=filename).first()
+        if attachment:
+            return jsonify(attachment.to_dict()), 200
+        
+        file_path = public_file_path(filename)
+        if not file_path:
             return jsonify({'message': 'Arquivo não encontrado'}), 404
         
-        # Obter informações do arquivo
+        # Arquivo ainda não registrado: informações do disco
         file_stats = os.stat(file_path)
         file_extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
         
@@ -141,33 +283,33 @@ def get_file_info(current_user, filename):
 @file_bp.route('/files', methods=['GET'])
 @token_required
 def list_files(current_user):
-    """Listar arquivos do usuário"""
+    """Listar arquivos (paginado; filtros type e owner_id)"""
     try:
-        files = []
-        
-        # Percorrer todos os tipos de arquivo
-        for file_type in ALLOWED_EXTENSIONS.keys():
-            type_folder = os.path.join(UPLOAD_FOLDER, file_type)
-            if os.path.exists(type_folder):
-                for filename in os.listdir(type_folder):
-                    file_path = os.path.join(type_folder, filename)
-                    if os.path.isfile(file_path):
-                        file_stats = os.stat(file_path)
-                        files.append({
-                            'filename': filename,
-                            'relative_path': os.path.join(file_type, filename),
-                            'file_type': file_type,
-                            'file_size': file_stats.st_size,
-                            'created_at': file_stats.st_ctime,
-                            'modified_at': file_stats.st_mtime
-                        })
-        
-        # Ordenar por data de criação (mais recente primeiro)
-        files.sort(key=lambda x: x['created_at'], reverse=True)
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', FILES_PAGE_SIZE, type=int)
+        per_page = max(1, min(per_page, MAX_FILES_PAGE_SIZE))
+        file_type = request.args.get('type')
+        owner_id = request.args.get('owner_id', type=int)
+        
+        query = Attachment.query
+        if file_type:
+            if file_type not in ALLOWED_EXTENSIONS:
+                return jsonify({'message': 'Tipo de arquivo inválido'}), 400
+            query = query.filter(Attachment.file_type == file_type)
+        
+        if owner_id:
+            query = query.filter(Attachment.owner_id == owner_id)
+        
+        # Mais recentes primeiro (índices por dono/tipo + created_at)
+        files = query.order_by(Attachment.created_at.desc(), Attachment.id.desc()).paginate(
+            page=page, per_page=per_page, error_out=False
+        )
         
         return jsonify({
-            'files': files,
-            'total': len(files)
+            'files': [attachment.to_dict() for attachment in files.items],
+            'total': files.total,
+            'pages': files.pages,
+            'current_page': page
         }), 200
         
     except Exception as e:
@@ -178,15 +320,186 @@ def list_files(current_user):
 def delete_file(current_user, filename):
     """Deletar arquivo"""
     try:
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
-        if not os.path.exists(file_path):
+        if not public_file_path(filename):
             return jsonify({'message': 'Arquivo não encontrado'}), 404
         
-        # Deletar arquivo
-        os.remove(file_path)
-        
+        # Remover o registro primeiro: se o commit falhar, o arquivo continua no disco
+        attachment = Attachment.query.filter_by(file_path=filename).first()
+        sha256 = attachment.sha256 if attachment else None
+        if attachment:
+            db.session.delete(attachment)
+            db.session.commit()
+
+        # Deletar arquivo (o conteúdo só é apagado quando não há outras referências)
+        try:
+            blob_store.release(filename, sha256)
+        except FileNotFoundError:
+            pass  # Já removido por uma requisição concorrente
+
         return jsonify({'message': 'Arquivo deletado com sucesso'}), 200
         
     except Exception as e:
+        db.session.rollback()
         return jsonify({'message': f'Erro ao deletar arquivo: {str(e)}'}), 500
 
+
+@file_bp.route('/uploads', methods=['POST'])
+@token_required
+def create_upload_session(current_user):
+    """Iniciar um upload retomável: {filename, size}"""
+    try:
+        data = request.get_json() or {}
+        filename = data.get('filename') or ''
+        size = data.get('size')
+        
+        is_allowed, file_type = allowed_file(filename)
+        if not is_allowed:
+            return jsonify({'message': 'Tipo de arquivo não permitido'}), 400
+        
+        max_size = current_app.config.get('RESUMABLE_MAX_SIZE', MAX_FILE_SIZE)
+        if not isinstance(size, int) or size <= 0:
+            return jsonify({'message': 'Campo size é obrigatório'}), 400
+        if size > max_size:
+            return jsonify({'message': f'Arquivo muito grande. Máximo: {max_size // (1024*1024)}MB'}), 400
+        
+        # Aproveitar a criação para recolher algumas sessões abandonadas
+        expire_upload_sessions(current_app.config.get('RESUMABLE_UPLOAD_TTL', 86400), limit=100)
+        
+        session = UploadSession(
+            id=uuid.uuid4().hex,
+            owner_id=current_user.id,
+            original_name=filename,
+            file_type=file_type,
+            total_size=size,
+            received=0
+        )
+        open(upload_session_path(session.id), 'wb').close()
+        db.session.add(session)
+        db.session.commit()
+        
+        response = session.to_dict()
+        response['chunk_size'] = current_app.config.get('RESUMABLE_CHUNK_SIZE', 4 * 1024 * 1024)
+        return jsonify(response), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'Erro ao iniciar upload: {str(e)}'}), 500
+
+def get_upload_session(current_user, upload_id):
+    session = db.session.get(UploadSession, upload_id)
+    if not session or session.owner_id != current_user.id:
+        return None
+    return session
+
+@file_bp.route('/uploads/<upload_id>', methods=['GET'])
+@token_required
+def get_upload_offset(current_user, upload_id):
+    """Consultar quantos bytes já foram recebidos (onde retomar)"""
+    try:
+        session = get_upload_session(current_user, upload_id)
+        if not session:
+            return jsonify({'message': 'Upload não encontrado'}), 404
+        
+        return jsonify(session.to_dict()), 200
+        
+    except Exception as e:
+        return jsonify({'message': f'Erro ao consultar upload: {str(e)}'}), 500
+
+@file_bp.route('/uploads/<upload_id>', methods=['PUT'])
+@token_required
+def put_upload_chunk(current_user, upload_id):
+    """Enviar um pedaço do arquivo a partir de ?offset= (corpo bruto, gravado em disco em blocos)"""
+    try:
+        session = get_upload_session(current_user, upload_id)
+        if not session:
+            return jsonify({'message': 'Upload não encontrado'}), 404
+        
+        offset = request.args.get('offset', type=int)
+        if offset != session.received:
+            # O cliente deve retomar do offset registrado
+            return jsonify({'message': 'Offset inválido', 'offset': session.received}), 409
+        
+        if request.content_length and offset + request.content_length > session.total_size:
+            return jsonify({'message': 'O pedaço ultrapassa o tamanho declarado', 'offset': offset}), 400
+        
+        position = offset
+        with open(upload_session_path(session.id), 'r+b') as f:
+            f.seek(offset)
+            try:
+                for chunk in iter(lambda: request.stream.read(CHUNK_SIZE), b''):
+                    if position + len(chunk) > session.total_size:
+                        # Descartar o excedente e manter o que cabia
+                        f.truncate(position)
+                        return jsonify({'message': 'O pedaço ultrapassa o tamanho declarado', 'offset': offset}), 400
+                    f.write(chunk)
+                    position += len(chunk)
+            except ClientDisconnected:
+                # Conexão caiu no meio do pedaço: o que chegou fica valendo
+                pass
+            f.truncate(position)
+        
+        # Só avança se ninguém gravou este mesmo trecho em paralelo
+        result = db.session.execute(
+            update(UploadSession)
+            .where(UploadSession.id == session.id, UploadSession.received == offset)
+            .values(received=position, updated_at=datetime.utcnow())
+        )
+        db.session.commit()
+        if result.rowcount == 0:
+            db.session.refresh(session)
+            return jsonify({'message': 'Offset inválido', 'offset': session.received}), 409
+        
+        return jsonify({'upload_id': session.id, 'offset': position, 'size': session.total_size}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'Erro ao receber pedaço: {str(e)}'}), 500
+
+@file_bp.route('/uploads/<upload_id>/complete', methods=['POST'])
+@token_required
+def complete_upload(current_user, upload_id):
+    """Concluir o upload: publicar o arquivo montado como um anexo comum"""
+    try:
+        session = get_upload_session(current_user, upload_id)
+        if not session:
+            return jsonify({'message': 'Upload não encontrado'}), 404
+        
+        if session.received != session.total_size:
+            return jsonify({'message': 'Upload incompleto', 'offset': session.received}), 409
+        
+        temp_path = upload_session_path(session.id)
+        sha256 = file_digest(temp_path)
+        relative_path = new_file_path(session.original_name, session.file_type)
+        blob_store.publish(temp_path, sha256, relative_path)
+        
+        original_name, file_type, size = session.original_name, session.file_type, session.total_size
+        db.session.delete(session)
+        response = register_upload(current_user, relative_path, file_type, size, sha256, original_name)
+        os.remove(temp_path)
+        return response
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'Erro ao concluir upload: {str(e)}'}), 500
+
+@file_bp.route('/uploads/<upload_id>', methods=['DELETE'])
+@token_required
+def cancel_upload(current_user, upload_id):
+    """Cancelar um upload retomável"""
+    try:
+        session = get_upload_session(current_user, upload_id)
+        if not session:
+            return jsonify({'message': 'Upload não encontrado'}), 404
+        
+        db.session.delete(session)
+        db.session.commit()
+        try:
+            os.remove(upload_session_path(upload_id))
+        except FileNotFoundError:
+            pass
+        
+        return jsonify({'message': 'Upload cancelado'}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'Erro ao cancelar upload: {str(e)}'}), 500
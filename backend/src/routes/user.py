@@ -1,7 +1,9 @@
 from flask import Blueprint, request, jsonify
 from flask_cors import CORS
 from src.models.user import db, User, Department
-from src.routes.auth import token_required, admin_required
+from src.models.serializers import serialize_users
+from src.routes.auth import token_required, admin_required, invalidate_principal, principal_from_user
+from src.services.room_acl import refresh_user
 
 user_bp = Blueprint('user', __name__)
 CORS(user_bp)
@@ -21,7 +23,7 @@ def get_users(current_user):
         )
         
         return jsonify({
-            'users': [user.to_dict() for user in users.items],
+            'users': serialize_users(users.items),
             'total': users.total,
             'pages': users.pages,
             'current_page': page
@@ -129,6 +131,8 @@ def update_user(current_user, user_id):
             user.set_password(data['password'])
         
         db.session.commit()
+        invalidate_principal(user_id)
+        refresh_user(user_id, principal_from_user(user))
         
         return jsonify({
             'message': 'Usuário atualizado com sucesso',
@@ -154,6 +158,8 @@ def delete_user(current_user, user_id):
         
         db.session.delete(user)
         db.session.commit()
+        invalidate_principal(user_id)
+        refresh_user(user_id, None)
         
         return jsonify({'message': 'Usuário deletado com sucesso'}), 200
         
@@ -2,8 +2,21 @@ from flask import Blueprint, request, jsonify
 from flask_cors import CORS
 from src.models.user import db, WhatsAppConnection
 from src.routes.auth import token_required, admin_required
+from src.services.room_acl import can_access_conversation
+from src.services.webhook_queue import webhook_queue
+from src.services.outbound import outbound_sender, QueueFull, NotConfigured
+from src.services.realtime import notify_new_message
+from src.services.inbox import record_inbox_event, record_inbox_events, publish_inbox_events
+from src.models.serializers import serialize_messages
+from src.services.metrics import webhook_payloads, observe_webhook_batch
+from src.services.conversation_routing import (
+    find_active_conversation, find_active_conversations, remember_conversation
+)
+from sqlalchemy import insert, select
+from datetime import datetime
 import requests
 import os
+import time
 
 whatsapp_bp = Blueprint('whatsapp', __name__)
 CORS(whatsapp_bp)
@@ -41,6 +54,7 @@ def connect_whatsapp(current_user):
             access_token=data['access_token'],
             webhook_verify_token=data['webhook_verify_token'],
             business_account_id=data['business_account_id'],
+            phone_number_id=data.get('phone_number_id'),
             is_active=True
         )
         
@@ -117,15 +131,13 @@ def webhook_verify():
 def webhook_receive():
     """Receber mensagens do WhatsApp"""
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True)
         
-        # Processar mensagens recebidas
-        if data and 'entry' in data:
-            for entry in data['entry']:
-                if 'changes' in entry:
-                    for change in entry['changes']:
-                        if change.get('field') == 'messages':
-                            process_whatsapp_message(change['value'])
+        # Apenas enfileirar o payload; o processamento é feito pelos workers da fila
+        # (outros formatos falhariam em todas as tentativas até irem para dead)
+        if isinstance(data, dict) and isinstance(data.get('entry'), list):
+            webhook_queue.enqueue(request.get_data())
+            webhook_payloads.inc()
         
         return jsonify({'status': 'success'}), 200
         
@@ -133,6 +145,17 @@ def webhook_receive():
         print(f'Erro no webhook: {str(e)}')
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@whatsapp_bp.route('/webhook/queue', methods=['GET'])
+@token_required
+@admin_required
+def webhook_queue_status(current_user):
+    """Obter profundidade da fila de ingestão do webhook"""
+    try:
+        return jsonify(webhook_queue.stats()), 200
+        
+    except Exception as e:
+        return jsonify({'message': f'Erro ao buscar status da fila: {str(e)}'}), 500
+
 def validate_whatsapp_token(access_token, business_account_id):
     """Validar token do WhatsApp Business API (simulado)"""
     try:
@@ -144,54 +167,127 @@ def validate_whatsapp_token(access_token, business_account_id):
     except:
         return False
 
+def process_webhook_payload(data):
+    """Processar um payload do webhook retirado da fila"""
+    values = []
+    for entry in data.get('entry', []):
+        for change in entry.get('changes', []):
+            if change.get('field') == 'messages':
+                values.append(change['value'])
+    
+    return process_whatsapp_messages(values)
+
 def process_whatsapp_message(message_data):
     """Processar mensagem recebida do WhatsApp"""
+    return process_whatsapp_messages([message_data])
+
+def process_whatsapp_messages(values):
+    """Processar em lote, numa única transação, as mensagens recebidas do WhatsApp"""
+    from src.models.user import Conversation, Message, Department
+    
+    received = [message for value in values for message in value.get('messages', [])]
+    if not received:
+        return []
+    
+    started_at = time.perf_counter()
     try:
-        from src.models.user import Conversation, Message, Department
-        
-        if 'messages' in message_data:
-            for message in message_data['messages']:
-                # Extrair dados da mensagem
-                contact_id = message['from']
-                message_text = message.get('text', {}).get('body', '')
-                message_type = message.get('type', 'text')
-                
-                # Buscar ou criar conversa
-                conversation = Conversation.query.filter_by(
-                    whatsapp_contact_id=contact_id
-                ).first()
-                
-                if not conversation:
-                    # Criar nova conversa no departamento padrão (Suporte)
-                    default_dept = Department.query.filter_by(name='Suporte').first()
-                    if default_dept:
-                        conversation = Conversation(
-                            whatsapp_contact_id=contact_id,
-                            contact_name=f'Cliente {contact_id[-4:]}',
-                            contact_phone=contact_id,
-                            department_id=default_dept.id,
-                            status='open'
-                        )
-                        db.session.add(conversation)
-                        db.session.flush()  # Para obter o ID
-                
-                # Criar mensagem
-                if conversation:
-                    new_message = Message(
-                        conversation_id=conversation.id,
-                        sender_type='customer',
-                        content=message_text,
-                        message_type=message_type
+        # Descartar wamids já gravados: a fila e a Meta podem reentregar o mesmo payload
+        wamids = {message['id'] for message in received if message.get('id')}
+        seen = set(db.session.scalars(
+            select(Message.whatsapp_message_id).where(Message.whatsapp_message_id.in_(wamids))
+        )) if wamids else set()
+        
+        # Agrupar mensagens por contato, preservando a ordem de chegada
+        messages_by_contact = {}
+        for message in received:
+            wamid = message.get('id')
+            if wamid:
+                if wamid in seen:
+                    continue
+                seen.add(wamid)
+            messages_by_contact.setdefault(message['from'], []).append(message)
+        
+        if not messages_by_contact:
+            print(f'{len(received)} mensagem(ns) duplicada(s) ignorada(s)')
+            return []
+        
+        # Buscar a conversa ativa de todos os contatos de uma vez
+        conversations = find_active_conversations(list(messages_by_contact))
+        
+        # Criar as conversas que faltam no departamento padrão (Suporte)
+        missing = [contact_id for contact_id in messages_by_contact if contact_id not in conversations]
+        new_conversations = []
+        if missing:
+            default_dept = Department.query.filter_by(name='Suporte').first()
+            if default_dept:
+                new_conversations = [
+                    Conversation(
+                        whatsapp_contact_id=contact_id,
+                        contact_name=f'Cliente {contact_id[-4:]}',
+                        contact_phone=contact_id,
+                        department_id=default_dept.id,
+                        status='open'
                     )
-                    db.session.add(new_message)
-                    db.session.commit()
-                    
-                    # Aqui você pode adicionar lógica para notificar agentes via Socket.IO
-                    print(f'Nova mensagem recebida: {message_text}')
-                    
+                    for contact_id in missing
+                ]
+                db.session.add_all(new_conversations)
+                db.session.flush()  # Para obter os IDs
+                for conversation in new_conversations:
+                    conversations[conversation.whatsapp_contact_id] = conversation
+        
+        # Inserir todas as mensagens de uma vez
+        now = datetime.utcnow()
+        rows = []
+        for contact_id, messages in messages_by_contact.items():
+            conversation = conversations.get(contact_id)
+            if not conversation:
+                continue
+            
+            conversation.updated_at = now
+            for message in messages:
+                rows.append({
+                    'conversation_id': conversation.id,
+                    'sender_type': 'customer',
+                    'content': message.get('text', {}).get('body', ''),
+                    'message_type': message.get('type', 'text'),
+                    'whatsapp_message_id': message.get('id'),
+                    'timestamp': now
+                })
+            conversation.record_messages('customer', rows[-1]['content'], now, count=len(messages))
+        
+        new_messages = []
+        if rows:
+            new_messages = db.session.scalars(
+                insert(Message).returning(Message, sort_by_parameter_order=True), rows
+            ).all()
+        
+        created_ids = {conversation.id for conversation in new_conversations}
+        inbox_events = record_inbox_events([
+            ('created' if conversation.id in created_ids else 'updated', conversation)
+            for contact_id, conversation in conversations.items()
+            if contact_id in messages_by_contact
+        ])
+        # Serializar antes do commit, que expira os objetos e custaria uma consulta por item
+        message_data = serialize_messages(new_messages)
+        new_contacts = [(conversation.whatsapp_contact_id, conversation.id) for conversation in new_conversations]
+        db.session.commit()
+        observe_webhook_batch(len(new_messages), time.perf_counter() - started_at)
+        publish_inbox_events(inbox_events)
+        
+        for contact_id, conversation_id in new_contacts:
+            remember_conversation(contact_id, conversation_id)
+        
+        for data in message_data:
+            notify_new_message(data['conversation_id'], data)
+        
+        print(f'{len(rows)} nova(s) mensagem(ns) recebida(s) de {len(messages_by_contact)} contato(s)')
+        return new_messages
+        
     except Exception as e:
-        print(f'Erro ao processar mensagem: {str(e)}')
+        print(f'Erro ao processar mensagens: {str(e)}')
         db.session.rollback()
+        # Propagar para que a fila faça a reentrega
+        raise
 
 @whatsapp_bp.route('/whatsapp/send-message', methods=['POST'])
 @token_required
@@ -209,47 +305,77 @@ def send_whatsapp_message(current_user):
         connection = WhatsAppConnection.query.filter_by(is_active=True).first()
         if not connection:
             return jsonify({'message': 'Nenhuma conexão WhatsApp ativa'}), 400
+        try:
+            outbound_sender.phone_number_id(connection)
+        except NotConfigured as e:
+            return jsonify({'message': str(e)}), 400
         
-        # Enviar mensagem (simulado)
-        success = send_message_to_whatsapp(
-            connection.access_token,
-            data['to'],
-            data['message']
-        )
+        # Salvar mensagem no banco
+        from src.models.user import Conversation, Message
         
-        if success:
-            # Salvar mensagem no banco
-            from src.models.user import Conversation, Message
-            
-            conversation = Conversation.query.filter_by(
-                whatsapp_contact_id=data['to']
-            ).first()
-            
-            if conversation:
-                new_message = Message(
-                    conversation_id=conversation.id,
-                    sender_type='agent',
-                    sender_id=current_user.id,
-                    content=data['message'],
-                    message_type='text'
-                )
-                db.session.add(new_message)
+        conversation = find_active_conversation(data['to']) or Conversation.query.filter_by(
+            whatsapp_contact_id=data['to']
+        ).order_by(Conversation.id.desc()).first()
+        
+        new_message = None
+        if conversation:
+            new_message = Message(
+                conversation_id=conversation.id,
+                sender_type='agent',
+                sender_id=current_user.id,
+                content=data['message'],
+                message_type='text',
+                timestamp=datetime.utcnow(),
+                delivery_status='pending'
+            )
+            db.session.add(new_message)
+            conversation.record_messages('agent', new_message.content, new_message.timestamp)
+            inbox_event = record_inbox_event('updated', conversation)
+            db.session.commit()
+            notify_new_message(conversation.id, new_message.to_dict())
+            publish_inbox_events([inbox_event])
+        
+        # Enfileirar o envio; o status de entrega é atualizado pelo worker
+        message_id = new_message.id if new_message else None
+        try:
+            outbound_sender.send_text(message_id, connection, data['to'], data['message'])
+        except QueueFull:
+            if new_message:
+                new_message.delivery_status = 'failed'
+                new_message.delivery_error = 'Fila de envio cheia'
                 db.session.commit()
-            
-            return jsonify({'message': 'Mensagem enviada com sucesso'}), 200
-        else:
-            return jsonify({'message': 'Erro ao enviar mensagem'}), 500
+            return jsonify({'message': 'Fila de envio cheia, tente novamente'}), 503
+        
+        return jsonify({
+            'message': 'Mensagem enfileirada para envio',
+            'message_id': message_id,
+            'delivery_status': 'pending'
+        }), 202
             
     except Exception as e:
+        db.session.rollback()
         return jsonify({'message': f'Erro ao enviar mensagem: {str(e)}'}), 500
 
-def send_message_to_whatsapp(access_token, to, message):
-    """Enviar mensagem para WhatsApp Business API (simulado)"""
+@whatsapp_bp.route('/whatsapp/messages/<int:message_id>/status', methods=['GET'])
+@token_required
+def get_delivery_status(current_user, message_id):
+    """Obter status de entrega de uma mensagem enviada"""
     try:
-        # Em produção, fazer chamada real para a API
-        # Por enquanto, simulamos o envio
-        print(f'Enviando mensagem para {to}: {message}')
-        return True
-    except:
-        return False
-
+        from src.models.user import Message
+        
+        message = Message.query.get(message_id)
+        if not message:
+            return jsonify({'message': 'Mensagem não encontrada'}), 404
+        
+        if not can_access_conversation(current_user, message.conversation):
+            return jsonify({'message': 'Acesso negado'}), 403
+        
+        return jsonify({
+            'message_id': message.id,
+            'delivery_status': message.delivery_status,
+            'whatsapp_message_id': message.whatsapp_message_id,
+            'delivery_error': message.delivery_error
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'message': f'Erro ao buscar status de entrega: {str(e)}'}), 500
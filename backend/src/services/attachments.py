@@ -0,0 +1,108 @@
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from src.models.user import db, Attachment, Message, UploadSession
+from src.services.blob_store import blob_store
+
+
+def record_attachment(file_path, file_type, file_size, sha256, original_name=None, owner_id=None):
+    """Registrar um upload no índice de anexos (commit a cargo de quem chama)"""
+    attachment = Attachment(
+        file_path=file_path,
+        file_type=file_type,
+        file_size=file_size,
+        sha256=sha256,
+        original_name=original_name,
+        owner_id=owner_id
+    )
+    db.session.add(attachment)
+    return attachment
+
+
+def reconcile_attachments(file_types, batch_size=1000, progress=print):
+    """Importar para a tabela de anexos os arquivos que só existem no disco
+
+    Percorre as pastas de cada tipo uma única vez: arquivos sem registro são
+    levados ao armazenamento por conteúdo e registrados (dono e mensagem vêm
+    de Message.file_path, quando houver); registros cujo arquivo sumiu são
+    removidos. Retorna (importados, removidos).
+    """
+    imported = removed = 0
+    for file_type in file_types:
+        folder = os.path.join(blob_store.root, file_type)
+        known = set(db.session.execute(
+            select(Attachment.file_path).where(Attachment.file_type == file_type)
+        ).scalars())
+        on_disk = set()
+
+        pending = []
+        entries = os.scandir(folder) if os.path.isdir(folder) else []
+        for entry in entries:
+            if not entry.is_file() or entry.name.endswith('.part'):
+                continue
+            relative_path = f'{file_type}/{entry.name}'
+            on_disk.add(relative_path)
+            if relative_path not in known:
+                pending.append((relative_path, entry.stat().st_mtime))
+            if len(pending) >= batch_size:
+                imported += _import_batch(file_type, pending)
+                pending = []
+                if progress:
+                    progress(f'  {file_type}: {imported} importados')
+        if pending:
+            imported += _import_batch(file_type, pending)
+
+        missing = known - on_disk
+        if missing:
+            missing = list(missing)
+            for start in range(0, len(missing), batch_size):
+                removed += Attachment.query.filter(
+                    Attachment.file_path.in_(missing[start:start + batch_size])
+                ).delete(synchronize_session=False)
+            db.session.commit()
+
+    return imported, removed
+
+
+def _import_batch(file_type, pending):
+    # Mensagens que referenciam os arquivos do lote, numa única consulta
+    paths = [relative_path for relative_path, _ in pending]
+    messages = {
+        file_path: (message_id, sender_id)
+        for file_path, message_id, sender_id in db.session.execute(
+            select(Message.file_path, Message.id, Message.sender_id).where(Message.file_path.in_(paths))
+        )
+    }
+
+    for relative_path, mtime in pending:
+        sha256, file_size = blob_store.adopt(relative_path)
+        message_id, owner_id = messages.get(relative_path, (None, None))
+        attachment = record_attachment(relative_path, file_type, file_size, sha256, owner_id=owner_id)
+        attachment.message_id = message_id
+        attachment.created_at = datetime.utcfromtimestamp(mtime)
+    db.session.commit()
+    return len(pending)
+
+
+def upload_session_path(upload_id):
+    return os.path.join(blob_store.tmp_dir, f'{upload_id}.upload')
+
+
+def expire_upload_sessions(ttl, limit=None):
+    """Remover sessões de upload retomável sem atividade há mais de ttl segundos; retorna quantas"""
+    cutoff = datetime.utcnow() - timedelta(seconds=ttl)
+    query = UploadSession.query.filter(UploadSession.updated_at < cutoff).order_by(UploadSession.updated_at)
+    if limit:
+        query = query.limit(limit)
+    expired = query.all()
+    for session in expired:
+        try:
+            os.remove(upload_session_path(session.id))
+        except FileNotFoundError:
+            pass
+        db.session.delete(session)
+    if expired:
+        db.session.commit()
+    return len(expired)
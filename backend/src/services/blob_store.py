@@ -0,0 +1,205 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+CHUNK_SIZE = 64 * 1024
+
+
+class FileTooLarge(Exception):
+    """Upload maior que o limite, interrompido durante a recepção"""
+
+
+class HashingWriter:
+    """Arquivo temporário que calcula o SHA-256 e limita o tamanho enquanto recebe os bytes
+
+    Usado como stream_factory do parser multipart: o upload vai direto para o disco,
+    sem ser bufferizado inteiro em memória.
+    """
+
+    def __init__(self, directory, max_size=None):
+        fd, self.path = tempfile.mkstemp(dir=directory, suffix='.part')
+        self.file = os.fdopen(fd, 'w+b')
+        self.max_size = max_size
+        self.size = 0
+        self._hash = hashlib.sha256()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise FileTooLarge(self.size)
+        self._hash.update(data)
+        return self.file.write(data)
+
+    @property
+    def digest(self):
+        return self._hash.hexdigest()
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __getattr__(self, name):
+        # seek/read/tell/close do arquivo real (o parser volta ao início ao terminar a parte)
+        return getattr(self.file, name)
+
+
+class BlobStore:
+    """Anexos endereçados pelo SHA-256 do conteúdo
+
+    O conteúdo fica uma única vez em blobs/aa/<sha256>; cada upload ganha um hard link
+    com o caminho público (ex.: image/<uuid>.jpg), de modo que um arquivo reenviado
+    custa só uma entrada de diretório. A contagem de referências é o st_nlink do blob:
+    quando só resta o próprio blob, ninguém mais o usa.
+
+    Funções em on_collect recebem o sha256 de cada blob recolhido (ex.: para apagar
+    arquivos derivados do conteúdo, como as prévias).
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.blob_root = os.path.join(root, 'blobs')
+        self.tmp_dir = os.path.join(self.blob_root, 'tmp')
+        self.on_collect = []
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_root, digest[:2], digest)
+
+    def writer(self, max_size=None):
+        return HashingWriter(self.tmp_dir, max_size)
+
+    def commit(self, writer, relative_path):
+        """Publicar o arquivo recebido em relative_path; retorna True se o conteúdo era novo"""
+        writer.file.close()
+        try:
+            return self.publish(writer.path, writer.digest, relative_path)
+        finally:
+            writer.discard()
+
+    def publish(self, temp_path, digest, relative_path):
+        """Ligar relative_path ao blob do conteúdo, criando o blob a partir de temp_path se faltar
+
+        temp_path continua existindo; quem chama o remove.
+        """
+        blob = self.blob_path(digest)
+        destination = os.path.join(self.root, relative_path)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+
+        created = False
+        try:
+            while True:
+                try:
+                    os.link(blob, destination)
+                    return created
+                except FileNotFoundError:
+                    # Conteúdo inédito (ou blob recolhido entre a checagem e o link)
+                    try:
+                        os.link(temp_path, blob)
+                        created = True
+                    except FileExistsError:
+                        pass
+        except OSError as e:
+            if isinstance(e, FileExistsError):
+                raise
+            # Sistema de arquivos sem hard link: cópia simples, sem deduplicação
+            shutil.copyfile(temp_path, destination)
+            return True
+
+    def store(self, stream, relative_path, max_size=None):
+        """Gravar um stream em relative_path; retorna (sha256, tamanho)"""
+        writer = self.writer(max_size)
+        try:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                writer.write(chunk)
+        except BaseException:
+            writer.discard()
+            raise
+        self.commit(writer, relative_path)
+        return writer.digest, writer.size
+
+    def adopt(self, relative_path):
+        """Trazer para o armazenamento por conteúdo um arquivo gravado fora dele
+
+        Retorna (sha256, tamanho). Se o conteúdo já existe, o arquivo passa a ser um
+        link para o blob e o espaço da cópia é liberado.
+        """
+        path = os.path.join(self.root, relative_path)
+        digest = file_digest(path)
+        size = os.stat(path).st_size
+        blob = self.blob_path(digest)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            os.link(path, blob)
+        except FileExistsError:
+            if not os.path.samefile(path, blob):
+                temp = os.path.join(self.tmp_dir, f'{digest}.{os.getpid()}.link')
+                os.link(blob, temp)
+                os.replace(temp, path)
+        return digest, size
+
+    def refcount(self, digest):
+        """Quantos arquivos públicos apontam para o blob"""
+        try:
+            return os.stat(self.blob_path(digest)).st_nlink - 1
+        except FileNotFoundError:
+            return 0
+
+    def release(self, relative_path, digest=None):
+        """Remover um arquivo público e recolher o blob se era a última referência"""
+        path = os.path.join(self.root, relative_path)
+        if os.stat(path).st_nlink == 2:
+            # Só este link e o blob: descobrir qual blob para removê-lo junto
+            digest = digest or file_digest(path)
+            os.remove(path)
+            blob = self.blob_path(digest)
+            try:
+                if os.stat(blob).st_nlink == 1:
+                    self._collect(blob, digest)
+            except FileNotFoundError:
+                pass
+        else:
+            os.remove(path)
+
+    def _collect(self, blob, digest):
+        os.remove(blob)
+        for callback in self.on_collect:
+            try:
+                callback(digest)
+            except Exception as e:
+                print(f'Erro ao limpar derivados do blob {digest}: {str(e)}')
+
+    def collect_garbage(self, max_temp_age=None):
+        """Remover blobs sem nenhuma referência e, com max_temp_age (segundos),
+        temporários abandonados; retorna quantos arquivos foram removidos"""
+        removed = 0
+        if max_temp_age is not None:
+            cutoff = time.time() - max_temp_age
+            for entry in os.scandir(self.tmp_dir):
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+        for prefix in os.listdir(self.blob_root):
+            directory = os.path.join(self.blob_root, prefix)
+            if prefix == 'tmp' or not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if os.stat(path).st_nlink == 1:
+                    self._collect(path, name)
+                    removed += 1
+        return removed
+
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+
+# Raiz dos uploads (o mesmo diretório servido por routes/file.py)
+blob_store = BlobStore(os.environ.get('UPLOAD_FOLDER', os.path.join(os.path.dirname(__file__), '..', 'uploads')))
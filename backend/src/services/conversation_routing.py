@@ -0,0 +1,64 @@
+from src.models.user import Conversation
+from src.services.cache import LRUCache
+
+# contato do WhatsApp -> id da conversa ativa (não fechada)
+active_conversation_cache = LRUCache(maxsize=10000)
+
+
+def init_app(app):
+    active_conversation_cache.maxsize = app.config.get('CONTACT_CACHE_SIZE', 10000)
+
+
+def find_active_conversations(contact_ids):
+    """Resolver a conversa ativa de cada contato; retorna {contact_id: Conversation}
+
+    Acertos no cache são confirmados por chave primária, já que outros processos
+    podem ter fechado a conversa; as falhas são resolvidas por uma única consulta
+    indexada em (whatsapp_contact_id, status).
+    """
+    conversations = {}
+    misses = set(contact_ids)
+
+    cached = {}
+    for contact_id in contact_ids:
+        conversation_id = active_conversation_cache.get(contact_id)
+        if conversation_id is not None:
+            cached[conversation_id] = contact_id
+
+    if cached:
+        for conversation in Conversation.query.filter(Conversation.id.in_(list(cached))):
+            contact_id = cached[conversation.id]
+            if conversation.status != 'closed' and conversation.whatsapp_contact_id == contact_id:
+                conversations[contact_id] = conversation
+                misses.discard(contact_id)
+        for contact_id in cached.values():
+            if contact_id not in conversations:
+                active_conversation_cache.delete(contact_id)
+
+    if misses:
+        # A conversa ativa mais recente de cada contato
+        rows = Conversation.query.filter(
+            Conversation.whatsapp_contact_id.in_(list(misses)),
+            Conversation.status != 'closed'
+        ).order_by(Conversation.id.desc())
+        for conversation in rows:
+            if conversation.whatsapp_contact_id not in conversations:
+                conversations[conversation.whatsapp_contact_id] = conversation
+                active_conversation_cache.set(conversation.whatsapp_contact_id, conversation.id)
+
+    return conversations
+
+
+def find_active_conversation(contact_id):
+    """Conversa ativa de um único contato (ou None)"""
+    return find_active_conversations([contact_id]).get(contact_id)
+
+
+def remember_conversation(contact_id, conversation_id):
+    """Registrar no cache uma conversa recém-criada"""
+    active_conversation_cache.set(contact_id, conversation_id)
+
+
+def invalidate_contact(contact_id):
+    """Descartar o mapeamento em cache de um contato (fechar, reabrir, transferir)"""
+    active_conversation_cache.delete(contact_id)
@@ -0,0 +1,89 @@
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from src.models.user import db
+
+
+def _sqlite_pragmas(app):
+    """PRAGMAs aplicados a cada conexão SQLite nova"""
+    return [
+        ('journal_mode', app.config.get('SQLITE_JOURNAL_MODE', 'WAL')),
+        ('synchronous', app.config.get('SQLITE_SYNCHRONOUS', 'NORMAL')),
+        ('busy_timeout', app.config.get('SQLITE_BUSY_TIMEOUT', 5000)),
+        ('mmap_size', app.config.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        ('cache_size', app.config.get('SQLITE_CACHE_SIZE', -64000)),
+        ('temp_store', 'MEMORY'),
+    ]
+
+
+def _is_memory(url):
+    return url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory'
+
+
+def engine_options(app, url):
+    """SQLALCHEMY_ENGINE_OPTIONS conforme o tipo de banco"""
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    if url.get_backend_name() == 'sqlite':
+        # O sqlite3 também espera pelo lock antes de devolver "database is locked"
+        connect_args = options.setdefault('connect_args', {})
+        connect_args.setdefault('timeout', app.config.get('SQLITE_BUSY_TIMEOUT', 5000) / 1000)
+    else:
+        options.setdefault('pool_size', app.config.get('DB_POOL_SIZE', 10))
+        options.setdefault('max_overflow', app.config.get('DB_MAX_OVERFLOW', 20))
+        options.setdefault('pool_timeout', app.config.get('DB_POOL_TIMEOUT', 30))
+        options.setdefault('pool_recycle', app.config.get('DB_POOL_RECYCLE', 1800))
+        options.setdefault('pool_pre_ping', app.config.get('DB_POOL_PRE_PING', True))
+    return options
+
+
+def init_app(app):
+    """Configurar o engine do db a partir de SQLALCHEMY_DATABASE_URI e imprimir o resumo
+
+    No SQLite cada conexão recebe WAL (leitores não bloqueiam o escritor),
+    synchronous=NORMAL (sem fsync por commit, seguro com WAL), busy_timeout (espera
+    pelo lock em vez de falhar com "database is locked"), mmap e cache. Em bancos
+    servidor o pool é dimensionado por DB_POOL_SIZE/DB_MAX_OVERFLOW, com pre-ping
+    para descartar conexões derrubadas pelo servidor.
+    """
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    is_sqlite = url.get_backend_name() == 'sqlite'
+
+    if is_sqlite and not _is_memory(url) and os.path.isabs(url.database):
+        os.makedirs(os.path.dirname(url.database), exist_ok=True)
+
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app, url)
+    db.init_app(app)
+
+    with app.app_context():
+        engine = db.engine
+        if is_sqlite:
+            pragmas = _sqlite_pragmas(app)
+            if _is_memory(engine.url):
+                pragmas = [(name, value) for name, value in pragmas if name not in ('journal_mode', 'mmap_size')]
+
+            @event.listens_for(engine, 'connect')
+            def apply_sqlite_pragmas(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                for name, value in pragmas:
+                    cursor.execute(f'PRAGMA {name}={value}')
+                cursor.close()
+
+        report(engine)
+
+
+def report(engine):
+    """Imprimir as configurações efetivas do banco"""
+    print(f"🗄️  Banco: {engine.url.render_as_string(hide_password=True)}")
+    if engine.dialect.name == 'sqlite':
+        with engine.connect() as connection:
+            effective = {
+                name: connection.exec_driver_sql(f'PRAGMA {name}').scalar()
+                for name in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size', 'cache_size')
+            }
+        print('   ' + ', '.join(f'{name}={value}' for name, value in effective.items()))
+    else:
+        pool = engine.pool
+        print(f"   pool={type(pool).__name__} size={pool.size()} max_overflow={getattr(pool, '_max_overflow', '-')} "
+              f"timeout={getattr(pool, '_timeout', '-')}s recycle={pool._recycle}s pre_ping={pool._pre_ping}")
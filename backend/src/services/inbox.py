@@ -0,0 +1,116 @@
+import json
+from collections import namedtuple
+
+from sqlalchemy import delete, func, inspect, or_, select
+
+from src.models.user import db, Conversation, InboxEvent
+from src.models.serializers import serialize_conversations
+from src.services.realtime import socketio
+
+# Deltas mantidos para retomada; clientes mais atrasados precisam recarregar a lista
+INBOX_EVENT_RETENTION = 50000
+# Máximo de deltas reenviados em uma retomada
+INBOX_RESUME_LIMIT = 500
+
+
+def inbox_rooms(user):
+    """Salas de caixa de entrada que o usuário acompanha (mesmas regras de inbox_query)"""
+    if user.role == 'admin' or (user.role == 'manager' and not user.department_id):
+        return ['inbox_all']
+    rooms = []
+    if user.department_id:
+        rooms.append(f'department_{user.department_id}')
+    if user.role == 'agent':
+        rooms.append(f'agent_{user.id}')
+    return rooms
+
+
+# Delta já gravado, pronto para emitir depois do commit (que expira os objetos do ORM)
+InboxDelta = namedtuple('InboxDelta', ['seq', 'rooms', 'data'])
+
+
+def record_inbox_event(op, conversation, from_department_id=None, from_agent_id=None):
+    """Registrar um delta na transação atual; publicar com publish_inbox_events após o commit"""
+    return record_inbox_events([(op, conversation)], from_department_id, from_agent_id)[0]
+
+
+def record_inbox_events(changes, from_department_id=None, from_agent_id=None):
+    """Registrar deltas [(op, conversa)] com uma flush e consultas em lote
+
+    Colunas atualizadas por expressão SQL (message_count) expiram na flush;
+    elas são recarregadas numa única consulta em vez de uma por conversa.
+    """
+    db.session.flush()
+    conversations = [conversation for _, conversation in changes]
+    expired_ids = [c.id for c in conversations if inspect(c).expired_attributes]
+    if expired_ids:
+        db.session.execute(
+            select(Conversation).where(Conversation.id.in_(expired_ids)).execution_options(populate_existing=True)
+        ).scalars().all()
+
+    events = [
+        InboxEvent(
+            op=op,
+            conversation_id=conversation.id,
+            department_id=conversation.department_id,
+            assigned_agent_id=conversation.assigned_agent_id,
+            from_department_id=from_department_id,
+            from_agent_id=from_agent_id,
+            payload=json.dumps(data)
+        )
+        for (op, conversation), data in zip(changes, serialize_conversations(conversations))
+    ]
+    db.session.add_all(events)
+    db.session.flush()
+    return [InboxDelta(event.id, event.rooms(), event.to_dict()) for event in events]
+
+
+def publish_inbox_events(deltas):
+    """Emitir os deltas já gravados para as salas de departamento/agente"""
+    for delta in deltas:
+        try:
+            socketio.emit('inbox_delta', delta.data, to=delta.rooms)
+        except Exception as e:
+            print(f'Erro ao emitir delta {delta.seq} da caixa de entrada: {str(e)}')
+
+    # Poda ocasional dos deltas antigos
+    if any(delta.seq % 1000 == 0 for delta in deltas):
+        newest = max(delta.seq for delta in deltas)
+        db.session.execute(delete(InboxEvent).where(InboxEvent.id <= newest - INBOX_EVENT_RETENTION))
+        db.session.commit()
+
+
+def latest_inbox_seq():
+    return db.session.execute(select(func.max(InboxEvent.id))).scalar() or 0
+
+
+def inbox_events_since(user, since, limit=INBOX_RESUME_LIMIT):
+    """Deltas visíveis ao usuário após `since`; None se a retomada não for possível"""
+    oldest, newest = db.session.execute(select(func.min(InboxEvent.id), func.max(InboxEvent.id))).one()
+    if oldest is not None and since + 1 < oldest:
+        return None
+    if since > (newest or 0):
+        # Cliente à frente do servidor (ex.: banco recriado)
+        return None
+
+    query = InboxEvent.query.filter(InboxEvent.id > since)
+    if 'inbox_all' not in inbox_rooms(user):
+        conditions = []
+        if user.department_id:
+            conditions += [
+                InboxEvent.department_id == user.department_id,
+                InboxEvent.from_department_id == user.department_id
+            ]
+        if user.role == 'agent':
+            conditions += [
+                InboxEvent.assigned_agent_id == user.id,
+                InboxEvent.from_agent_id == user.id
+            ]
+        if not conditions:
+            return []
+        query = query.filter(or_(*conditions))
+
+    events = query.order_by(InboxEvent.id).limit(limit + 1).all()
+    if len(events) > limit:
+        return None
+    return events
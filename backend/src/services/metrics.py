@@ -0,0 +1,100 @@
+import os
+import time
+
+from flask import Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+from sqlalchemy import event
+
+from src.models.user import db
+
+# Com vários workers do gunicorn, PROMETHEUS_MULTIPROC_DIR (definido em gunicorn.conf.py
+# antes do fork) faz cada processo gravar suas séries num diretório compartilhado,
+# agregado na hora da coleta
+
+http_requests = Counter(
+    'http_requests_total', 'Requisições HTTP',
+    ['blueprint', 'endpoint', 'method', 'status']
+)
+http_request_duration = Histogram(
+    'http_request_duration_seconds', 'Latência das requisições HTTP',
+    ['blueprint', 'endpoint', 'method'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+
+webhook_payloads = Counter('webhook_payloads_received_total', 'Payloads do webhook aceitos na fila')
+webhook_messages = Counter('webhook_messages_processed_total', 'Mensagens do webhook gravadas')
+webhook_message_duration = Histogram(
+    'webhook_message_processing_seconds', 'Tempo de processamento por mensagem (lote dividido pelo tamanho)',
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+)
+webhook_queue_latency = Histogram(
+    'webhook_queue_latency_seconds', 'Tempo entre o recebimento do payload e o fim do processamento',
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+)
+
+db_query_duration = Histogram(
+    'db_query_duration_seconds', 'Duração das instruções SQL',
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1)
+)
+db_pool_checked_out = Gauge('db_pool_checked_out', 'Conexões do pool em uso', multiprocess_mode='livesum')
+db_pool_size = Gauge('db_pool_size', 'Conexões abertas no pool', multiprocess_mode='livesum')
+
+socketio_clients = Gauge('socketio_connected_clients', 'Clientes Socket.IO conectados', multiprocess_mode='livesum')
+socketio_rooms = Gauge('socketio_rooms', 'Salas Socket.IO com participantes', multiprocess_mode='livesum')
+socketio_emits = Counter('socketio_emits_total', 'Eventos Socket.IO despachados aos clientes', ['event'])
+socketio_batches_dropped = Counter('socketio_batches_dropped_total', 'Lotes descartados por backpressure')
+
+upload_bytes = Counter('upload_bytes_total', 'Bytes recebidos em uploads', ['file_type'])
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_started_at', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    db_query_duration.observe(time.perf_counter() - conn.info['metrics_started_at'].pop())
+
+
+def init_app(app):
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(db.engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started_at = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started_at = g.pop('metrics_started_at', None)
+        if started_at is None:
+            return response
+        blueprint = request.blueprint or 'app'
+        endpoint = request.endpoint or 'not_found'
+        http_requests.labels(blueprint, endpoint, request.method, response.status_code).inc()
+        http_request_duration.labels(blueprint, endpoint, request.method).observe(time.perf_counter() - started_at)
+
+        pool = db.engine.pool
+        if hasattr(pool, 'checkedout'):
+            db_pool_checked_out.set(pool.checkedout())
+            db_pool_size.set(pool.checkedin() + pool.checkedout())
+        return response
+
+
+def observe_webhook_batch(message_count, elapsed):
+    """Registrar um lote de mensagens do webhook gravado em elapsed segundos"""
+    webhook_messages.inc(message_count)
+    for _ in range(message_count):
+        webhook_message_duration.observe(elapsed / message_count)
+
+
+def metrics_response():
+    """Exposição no formato texto do Prometheus (agregando os workers em modo multiprocesso)"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
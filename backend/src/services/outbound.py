@@ -0,0 +1,325 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import func, select, update
+
+from src.models.user import db, Conversation, Message, WhatsAppConnection
+
+
+class QueueFull(Exception):
+    """Fila de envio cheia"""
+
+
+class NotConfigured(Exception):
+    """Conexão sem o phone_number_id da Graph API"""
+
+
+class TokenBucket:
+    """Limite de taxa por token bucket (thread-safe)"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Reservar um token; retorna quantos segundos esperar antes de usá-lo"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class CircuitBreaker:
+    """Abre após N falhas seguidas; após o tempo de espera deixa passar uma tentativa"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def retry_after(self):
+        """0 se a chamada pode ser feita; senão, segundos até a próxima tentativa"""
+        with self._lock:
+            if self.opened_at is None:
+                return 0
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                return remaining
+            # Meio-aberto: apenas uma chamada de teste por vez
+            self.opened_at = time.monotonic()
+            return 0
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class PermanentError(Exception):
+    """Erro que não deve ser repetido (ex.: 400 da Graph API)"""
+
+
+class OutboundJob:
+    def __init__(self, message_id, connection_id, access_token, phone_number_id, to, text):
+        self.message_id = message_id
+        self.connection_id = connection_id
+        self.access_token = access_token
+        self.phone_number_id = phone_number_id
+        self.to = to
+        self.text = text
+        self.attempts = 0
+        self.created_at = time.monotonic()
+
+
+class OutboundSender:
+    """Envio assíncrono de mensagens para a WhatsApp Cloud API
+
+    Conexões HTTP persistentes (pool do requests), pool limitado de workers,
+    retentativas com backoff exponencial, limite de taxa e circuit breaker por
+    WhatsAppConnection. O status de entrega é gravado na própria Message.
+
+    A fila fica em memória: um envio que não termina em OUTBOUND_MAX_AGE segundos
+    é marcado como 'failed', e resume_pending() reenfileira na inicialização as
+    mensagens que ficaram 'pending' porque o processo que as enviaria parou.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.session = None
+        self.executor = None
+        self.buckets = {}
+        self.breakers = {}
+        self._slots = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        config = app.config
+        self.api_url = config.get('WHATSAPP_API_URL', 'https://graph.facebook.com/v18.0').rstrip('/')
+        self.workers = config.get('OUTBOUND_WORKERS', 4)
+        self.max_retries = config.get('OUTBOUND_MAX_RETRIES', 5)
+        self.backoff_base = config.get('OUTBOUND_BACKOFF_BASE', 0.5)
+        self.backoff_max = config.get('OUTBOUND_BACKOFF_MAX', 60)
+        self.timeout = config.get('OUTBOUND_TIMEOUT', 10)
+        self.rate = config.get('OUTBOUND_RATE_PER_SECOND', 20)
+        self.breaker_threshold = config.get('OUTBOUND_BREAKER_THRESHOLD', 5)
+        self.breaker_reset = config.get('OUTBOUND_BREAKER_RESET', 30)
+        self.max_age = config.get('OUTBOUND_MAX_AGE', 600)
+        self.queue_size = config.get('OUTBOUND_QUEUE_SIZE', 1000)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.workers, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='whatsapp-outbound')
+        # Jobs pendentes (na fila ou aguardando retentativa)
+        self._slots = threading.BoundedSemaphore(self.queue_size)
+        app.extensions['outbound_sender'] = self
+
+    def _bucket(self, connection_id):
+        with self._lock:
+            if connection_id not in self.buckets:
+                self.buckets[connection_id] = TokenBucket(self.rate)
+            return self.buckets[connection_id]
+
+    def _breaker(self, connection_id):
+        with self._lock:
+            if connection_id not in self.breakers:
+                self.breakers[connection_id] = CircuitBreaker(self.breaker_threshold, self.breaker_reset)
+            return self.breakers[connection_id]
+
+    def submit(self, job):
+        """Enfileirar um envio; levanta QueueFull se o limite de pendências foi atingido"""
+        if not self._slots.acquire(blocking=False):
+            raise QueueFull()
+        self.executor.submit(self._run, job)
+
+    def phone_number_id(self, connection):
+        """Id do número na Graph API (não é o número de telefone exibido)
+
+        Levanta NotConfigured se nem a conexão nem WHATSAPP_PHONE_ID o informam.
+        """
+        phone_number_id = connection.phone_number_id or self.app.config.get('WHATSAPP_PHONE_ID')
+        if not phone_number_id:
+            raise NotConfigured('Conexão WhatsApp sem phone_number_id configurado')
+        return phone_number_id
+
+    def send_text(self, message_id, connection, to, text):
+        """Enfileirar uma mensagem de texto pela conexão informada"""
+        phone_number_id = self.phone_number_id(connection)
+        self.submit(OutboundJob(message_id, connection.id, connection.access_token, phone_number_id, to, text))
+
+    def _schedule(self, job, delay):
+        if delay <= 0:
+            self.executor.submit(self._run, job)
+            return
+        timer = threading.Timer(delay, self.executor.submit, args=(self._run, job))
+        timer.daemon = True
+        timer.start()
+
+    def _run(self, job):
+        breaker = self._breaker(job.connection_id)
+        wait = breaker.retry_after()
+        if wait:
+            self._schedule(job, wait)
+            return
+
+        wait = self._bucket(job.connection_id).reserve()
+        if wait:
+            time.sleep(wait)
+
+        # Nenhuma tentativa começa depois do prazo (ver resume_pending)
+        if time.monotonic() - job.created_at > self.max_age:
+            self._finish(job, 'failed', error='Tempo limite de envio esgotado')
+            return
+
+        job.attempts += 1
+        try:
+            external_id = self.deliver(job)
+        except PermanentError as e:
+            breaker.record_success()
+            self._finish(job, 'failed', error=str(e))
+        except Exception as e:
+            breaker.record_failure()
+            if job.attempts > self.max_retries:
+                self._finish(job, 'failed', error=str(e))
+            else:
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (job.attempts - 1))
+                self._schedule(job, delay * random.uniform(0.5, 1.5))
+        else:
+            breaker.record_success()
+            self._finish(job, 'sent', external_id=external_id)
+
+    def deliver(self, job):
+        """Uma chamada à Graph API; retorna o id da mensagem no WhatsApp"""
+        response = self.session.post(
+            f'{self.api_url}/{job.phone_number_id}/messages',
+            headers={'Authorization': f'Bearer {job.access_token}'},
+            json={
+                'messaging_product': 'whatsapp',
+                'recipient_type': 'individual',
+                'to': job.to,
+                'type': 'text',
+                'text': {'body': job.text}
+            },
+            timeout=self.timeout
+        )
+        if response.status_code == 429 or response.status_code >= 500:
+            raise requests.HTTPError(f'{response.status_code}: {response.text[:200]}')
+        if response.status_code >= 400:
+            raise PermanentError(f'{response.status_code}: {response.text[:200]}')
+        # Aceita pela API: um corpo inesperado não pode levar a um reenvio
+        try:
+            return response.json()['messages'][0]['id']
+        except (ValueError, KeyError, IndexError, TypeError):
+            return None
+
+    def resume_pending(self):
+        """Reenfileirar as mensagens 'pending' abandonadas; retorna quantas
+
+        Uma mensagem enfileirada há mais de OUTBOUND_MAX_AGE (mais o timeout de uma
+        tentativa) não está mais na fila de nenhum processo vivo. Cada uma é
+        reivindicada com um UPDATE condicional em delivery_queued_at, então vários
+        workers iniciando ao mesmo tempo não a enviam em dobro.
+        """
+        with self.app.app_context():
+            connection = WhatsAppConnection.query.filter_by(is_active=True).first()
+            if connection is None:
+                return 0
+            try:
+                self.phone_number_id(connection)
+            except NotConfigured as e:
+                print(f'Envios pendentes não reenfileirados: {str(e)}')
+                return 0
+
+            now = datetime.utcnow()
+            queued_at = func.coalesce(Message.delivery_queued_at, Message.timestamp)
+            stale = (
+                Message.delivery_status == 'pending',
+                queued_at < now - timedelta(seconds=self.max_age + self.timeout),
+            )
+            rows = db.session.execute(
+                select(Message.id, Message.content, Conversation.contact_phone, Conversation.whatsapp_contact_id)
+                .join(Conversation, Conversation.id == Message.conversation_id)
+                .where(*stale)
+                .order_by(Message.id)
+                .limit(self.queue_size)
+            ).all()
+
+            resumed = 0
+            for message_id, content, contact_phone, contact_id in rows:
+                claimed = db.session.execute(
+                    update(Message).where(Message.id == message_id, *stale).values(delivery_queued_at=now)
+                ).rowcount
+                db.session.commit()
+                if not claimed:
+                    continue
+                try:
+                    self.send_text(message_id, connection, contact_phone or contact_id, content)
+                except QueueFull:
+                    # As restantes continuam 'pending' para a próxima inicialização
+                    db.session.execute(
+                        update(Message).where(Message.id == message_id).values(
+                            delivery_status='failed', delivery_error='Fila de envio cheia'
+                        )
+                    )
+                    db.session.commit()
+                    break
+                resumed += 1
+            return resumed
+
+    def _finish(self, job, status, external_id=None, error=None):
+        self._slots.release()
+        if job.message_id is None:
+            return
+        try:
+            with self.app.app_context():
+                db.session.execute(
+                    update(Message).where(Message.id == job.message_id).values(
+                        delivery_status=status,
+                        whatsapp_message_id=external_id,
+                        delivery_error=error[:500] if error else None
+                    )
+                )
+                db.session.commit()
+        except Exception as e:
+            print(f'Erro ao gravar status de entrega da mensagem {job.message_id}: {str(e)}')
+
+    def stats(self):
+        return {
+            'circuit_breakers': {
+                str(connection_id): breaker.state for connection_id, breaker in self.breakers.items()
+            }
+        }
+
+
+outbound_sender = OutboundSender()
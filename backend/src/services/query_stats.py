@@ -0,0 +1,112 @@
+import json
+import time
+from collections import Counter
+
+from flask import g, has_request_context, jsonify, request
+from sqlalchemy import event
+
+from src.models.user import db
+
+
+class QueryStats:
+    """Consultas SQL executadas durante uma requisição"""
+
+    __slots__ = ('count', 'total', 'slowest', 'slowest_statement', 'statements')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+        self.statements = Counter()
+
+    def record(self, statement, elapsed):
+        self.count += 1
+        self.total += elapsed
+        self.statements[statement] += 1
+        if elapsed > self.slowest:
+            self.slowest = elapsed
+            self.slowest_statement = statement
+
+    def repeated(self, threshold):
+        """Instruções idênticas executadas threshold vezes ou mais: prováveis N+1"""
+        return [(statement, n) for statement, n in self.statements.most_common() if n >= threshold]
+
+
+def current_stats():
+    if not has_request_context():
+        return None
+    return g.get('query_stats')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started_at', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started_at'].pop()
+    stats = current_stats()
+    if stats is not None:
+        stats.record(statement, elapsed)
+
+
+def init_app(app):
+    """Instrumentar o engine do db e anotar cada resposta com as consultas executadas
+
+    SQL_INSTRUMENTATION liga/desliga; SQL_LOG_REQUESTS registra uma linha JSON por
+    requisição (N+1 e estouro de orçamento são sempre registrados);
+    SQL_N_PLUS_ONE_THRESHOLD é o número de repetições de uma mesma instrução que
+    caracteriza N+1; SQL_QUERY_BUDGET limita as consultas por requisição e, com
+    SQL_STRICT (testes), a requisição que estourar responde 500.
+    """
+    if not app.config.get('SQL_INSTRUMENTATION', True):
+        return
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(db.engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def start_query_stats():
+        g.query_stats = QueryStats()
+
+    @app.after_request
+    def report_query_stats(response):
+        stats = g.pop('query_stats', None)
+        if stats is None:
+            return response
+
+        response.headers.add('Server-Timing', f'db;dur={stats.total * 1000:.2f};desc="{stats.count} queries"')
+        if stats.count:
+            response.headers.add('Server-Timing', f'db-slowest;dur={stats.slowest * 1000:.2f}')
+
+        repeated = stats.repeated(app.config.get('SQL_N_PLUS_ONE_THRESHOLD', 5))
+        budget = app.config.get('SQL_QUERY_BUDGET', 0)
+        over_budget = bool(budget) and stats.count > budget
+
+        if repeated or over_budget or app.config.get('SQL_LOG_REQUESTS', False):
+            print(json.dumps({
+                'event': 'sql_request',
+                'method': request.method,
+                'path': request.path,
+                'endpoint': request.endpoint,
+                'status': response.status_code,
+                'queries': stats.count,
+                'db_ms': round(stats.total * 1000, 2),
+                'slowest_ms': round(stats.slowest * 1000, 2),
+                'slowest': stats.slowest_statement,
+                'n_plus_one': [{'statement': statement, 'count': n} for statement, n in repeated],
+                'over_budget': over_budget
+            }, ensure_ascii=False))
+
+        if over_budget and app.config.get('SQL_STRICT', False):
+            failed = jsonify({
+                'message': f'Orçamento de consultas excedido: {stats.count} > {budget}',
+                'queries': stats.count,
+                'n_plus_one': [statement for statement, _ in repeated]
+            })
+            failed.status_code = 500
+            for value in response.headers.getlist('Server-Timing'):
+                failed.headers.add('Server-Timing', value)
+            return failed
+        return response
@@ -0,0 +1,373 @@
+import json
+import os
+import queue
+import socket
+import threading
+import time
+from urllib.parse import urlparse
+
+import socketio as python_socketio
+from engineio import packet as eio_packet
+from flask_socketio import SocketIO
+from socketio import Manager, PubSubManager, packet
+
+from src.services.metrics import socketio_batches_dropped, socketio_clients, socketio_emits, socketio_rooms
+
+socketio = SocketIO()
+
+
+class BufferedManager(Manager):
+    """Gerenciador com limite de buffer por cliente para os eventos em lote
+
+    Se a fila de saída do engine.io de um cliente passar de max_buffer pacotes,
+    os lotes seguintes são descartados para ele; quando a fila esvaziar até a
+    metade, o cliente recebe 'resync' e deve recarregar o estado pela API.
+    """
+
+    buffered_events = ('new_messages',)
+    max_buffer = 64
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.behind = {}
+        self.batches_dropped = 0
+        self.resyncs_sent = 0
+
+    def buffer_depth(self, eio_sid):
+        """Pacotes aguardando envio para o cliente neste processo"""
+        eio_socket = self.server.eio.sockets.get(eio_sid)
+        return eio_socket.queue.qsize() if eio_socket is not None else 0
+
+    def _eio_packets(self, event, data, namespace):
+        if isinstance(data, tuple):
+            data = list(data)
+        elif data is not None:
+            data = [data]
+        else:
+            data = []
+        encoded = self.server.packet_class(packet.EVENT, namespace=namespace, data=[event] + data).encode()
+        if not isinstance(encoded, list):
+            encoded = [encoded]
+        return [eio_packet.Packet(eio_packet.MESSAGE, p) for p in encoded]
+
+    def emit(self, event, data, namespace, room=None, skip_sid=None, callback=None, to=None, **kwargs):
+        socketio_emits.labels(event).inc()
+        if event not in self.buffered_events or callback is not None:
+            return super().emit(event, data, namespace, room=room, skip_sid=skip_sid,
+                                callback=callback, to=to, **kwargs)
+        room = to or room
+        if namespace not in self.rooms:
+            return
+        if not isinstance(skip_sid, list):
+            skip_sid = [skip_sid]
+
+        eio_pkts = self._eio_packets(event, data, namespace)
+        for sid, eio_sid in list(self.get_participants(namespace, room)):
+            if sid in skip_sid:
+                continue
+            depth = self.buffer_depth(eio_sid)
+            if sid in self.behind:
+                if depth > self.max_buffer // 2:
+                    self.behind[sid] += 1
+                    self.batches_dropped += 1
+                    socketio_batches_dropped.inc()
+                    continue
+                self._send_resync(sid, eio_sid, namespace)
+            elif depth >= self.max_buffer:
+                self.behind[sid] = 1
+                self.batches_dropped += 1
+                socketio_batches_dropped.inc()
+                continue
+            for p in eio_pkts:
+                self.server._send_eio_packet(eio_sid, p)
+
+    def _send_resync(self, sid, eio_sid, namespace):
+        dropped = self.behind.pop(sid, 0)
+        for p in self._eio_packets('resync', {'reason': 'backpressure', 'dropped_batches': dropped}, namespace):
+            self.server._send_eio_packet(eio_sid, p)
+        self.resyncs_sent += 1
+
+    def release_drained(self, namespace='/'):
+        """Enviar 'resync' aos clientes atrasados cujo buffer já esvaziou"""
+        for sid in list(self.behind):
+            eio_sid = self.eio_sid_from_sid(sid, namespace)
+            if eio_sid is None:
+                self.behind.pop(sid, None)
+            elif self.buffer_depth(eio_sid) <= self.max_buffer // 2:
+                self._send_resync(sid, eio_sid, namespace)
+
+    def disconnect(self, sid, namespace, **kwargs):
+        self.behind.pop(sid, None)
+        return super().disconnect(sid, namespace, **kwargs)
+
+    def basic_enter_room(self, sid, namespace, room, eio_sid=None):
+        super().basic_enter_room(sid, namespace, room, eio_sid=eio_sid)
+        self._update_gauges(namespace)
+
+    def basic_leave_room(self, sid, namespace, room):
+        super().basic_leave_room(sid, namespace, room)
+        self._update_gauges(namespace)
+
+    def _update_gauges(self, namespace):
+        if namespace != '/':
+            return
+        rooms = self.rooms.get(namespace, {})
+        clients = len(rooms.get(None, ()))
+        socketio_clients.set(clients)
+        # Fora a sala de todos (None) e a sala individual de cada cliente
+        socketio_rooms.set(max(len(rooms) - clients - (None in rooms), 0))
+
+    def stats(self):
+        depths = [s.queue.qsize() for s in list(self.server.eio.sockets.values())] if self.server else []
+        return {
+            'clients': len(depths),
+            'clients_behind': len(self.behind),
+            'max_client_buffer': max(depths, default=0),
+            'batches_dropped': self.batches_dropped,
+            'resyncs_sent': self.resyncs_sent
+        }
+
+
+class LocalPubSubManager(PubSubManager, BufferedManager):
+    """Pub/sub em memória: vários servidores Socket.IO no mesmo processo (testes)"""
+
+    name = 'memory'
+    _channels = {}
+    _channels_lock = threading.Lock()
+
+    def __init__(self, url='memory://', channel='socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.inbox = queue.Queue()
+        if not write_only:
+            with self._channels_lock:
+                self._channels.setdefault(channel, []).append(self.inbox)
+
+    def _publish(self, data):
+        with self._channels_lock:
+            subscribers = list(self._channels.get(self.channel, []))
+        for inbox in subscribers:
+            inbox.put(data)
+
+    def _listen(self):
+        while True:
+            yield self.inbox.get()
+
+
+class UnixSocketPubSubManager(PubSubManager, BufferedManager):
+    """Pub/sub entre processos do mesmo host, sem broker, via sockets Unix de datagrama
+
+    Cada processo escuta em <diretório>/<canal>/<host_id>.sock; publicar é enviar
+    o datagrama para todos os sockets do diretório. Sockets de processos mortos
+    são removidos no primeiro envio que falhar.
+
+    Os datagramas são JSON (nunca pickle) e o diretório do canal só é acessível ao
+    usuário do processo (0700): outro usuário do host não consegue injetar eventos.
+    Sem diretório na URL (unix://) usa-se default_directory.
+    """
+
+    name = 'unix'
+
+    def __init__(self, url='unix://', channel='socketio', write_only=False, logger=None, default_directory=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        base = urlparse(url).path or default_directory
+        if not base:
+            raise ValueError('Informe o diretório dos sockets: unix:///caminho')
+        self.directory = os.path.join(base, channel)
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        self._check_private(self.directory)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 * 1024 * 1024)
+        self.path = None
+        self._peer_paths = []
+        self._peers_listed_at = 0
+        if not write_only:
+            self.path = os.path.join(self.directory, f'{self.host_id}.sock')
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+            self.sock.bind(self.path)
+
+    @staticmethod
+    def _check_private(directory):
+        """Garantir que o diretório é do usuário do processo e fechado para os demais"""
+        info = os.stat(directory)
+        if info.st_uid != os.getuid():
+            raise PermissionError(f'{directory} pertence a outro usuário')
+        if info.st_mode & 0o077:
+            os.chmod(directory, 0o700)
+
+    def _peers(self):
+        """Sockets do canal; a listagem do diretório é reaproveitada por até 1s"""
+        now = time.monotonic()
+        if now - self._peers_listed_at > 1:
+            self._peer_paths = [
+                os.path.join(self.directory, name)
+                for name in os.listdir(self.directory) if name.endswith('.sock')
+            ]
+            self._peers_listed_at = now
+        return self._peer_paths
+
+    def _publish(self, data):
+        payload = json.dumps(data, separators=(',', ':')).encode()
+        for path in self._peers():
+            try:
+                self.sock.sendto(payload, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                self._peers_listed_at = 0
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            except OSError as e:
+                self._get_logger().error(f'Falha ao publicar em {path}: {e}')
+
+    def _listen(self):
+        while True:
+            datagram = self.sock.recv(16 * 1024 * 1024)
+            # Entregar já decodificado: o PubSubManager tentaria pickle.loads em bytes
+            try:
+                data = json.loads(datagram)
+            except ValueError:
+                self._get_logger().error('Datagrama inválido descartado')
+                continue
+            if isinstance(data, dict):
+                yield data
+
+
+def create_client_manager(url, channel='socketio', write_only=False, run_directory=None):
+    """Gerenciador de clientes para a URL do pub/sub, sempre com limite de buffer por cliente"""
+    if not url:
+        return BufferedManager()
+    if url.startswith('memory://'):
+        return LocalPubSubManager(url, channel=channel, write_only=write_only)
+    if url.startswith('unix://'):
+        return UnixSocketPubSubManager(url, channel=channel, write_only=write_only,
+                                       default_directory=run_directory)
+    # Mesma escolha de backend que o Flask-SocketIO faz para message_queue
+    if url.startswith(('redis://', 'rediss://')):
+        queue_class = python_socketio.RedisManager
+    elif url.startswith('kafka://'):
+        queue_class = python_socketio.KafkaManager
+    elif url.startswith('zmq'):
+        queue_class = python_socketio.ZmqManager
+    else:
+        queue_class = python_socketio.KombuManager
+    buffered_class = type(f'Buffered{queue_class.__name__}', (queue_class, BufferedManager), {})
+    return buffered_class(url, channel=channel, write_only=write_only)
+
+
+class EventBatcher:
+    """Agrupa eventos por conversa numa janela curta e emite um pacote por sala"""
+
+    def __init__(self, window=0.04, legacy_events=True):
+        self.window = window
+        # Também emitir um 'new_message' por mensagem, para o bundle do frontend
+        # publicado em src/static, que ainda não trata 'new_messages'
+        self.legacy_events = legacy_events
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.scheduled = False
+        self.events_batched = 0
+        self.batches_emitted = 0
+        self.largest_batch = 0
+
+    def add(self, conversation_id, message_data):
+        with self.lock:
+            self.pending.setdefault(conversation_id, []).append(message_data)
+            self.events_batched += 1
+            if self.window <= 0:
+                start = False
+            elif self.scheduled:
+                return
+            else:
+                self.scheduled = start = True
+        if start:
+            socketio.start_background_task(self._flush_after_window)
+        else:
+            self.flush()
+
+    def _flush_after_window(self):
+        socketio.sleep(self.window)
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.scheduled = False
+        for conversation_id, messages in pending.items():
+            self.batches_emitted += 1
+            self.largest_batch = max(self.largest_batch, len(messages))
+            emit_event('new_messages', {
+                'conversation_id': conversation_id,
+                'messages': messages
+            }, room=f'conversation_{conversation_id}')
+            if self.legacy_events:
+                for message in messages:
+                    emit_event('new_message', {
+                        'conversation_id': conversation_id,
+                        'message': message
+                    }, room=f'conversation_{conversation_id}')
+        manager = socketio.server.manager if socketio.server else None
+        if isinstance(manager, BufferedManager) and manager.behind:
+            manager.release_drained()
+
+    def stats(self):
+        with self.lock:
+            queued = sum(len(messages) for messages in self.pending.values())
+        return {
+            'window_ms': int(self.window * 1000),
+            'queued_events': queued,
+            'events_batched': self.events_batched,
+            'batches_emitted': self.batches_emitted,
+            'largest_batch': self.largest_batch
+        }
+
+
+message_batcher = EventBatcher()
+
+
+def init_app(app):
+    url = app.config.get('SOCKETIO_MESSAGE_QUEUE')
+    channel = app.config.get('SOCKETIO_CHANNEL', 'whatsapp-socketio')
+    # unix:// sem caminho: sockets em instance/socketio, privado ao usuário do app
+    manager = create_client_manager(url, channel=channel, run_directory=os.path.join(app.instance_path, 'socketio'))
+    manager.max_buffer = app.config.get('SOCKETIO_CLIENT_BUFFER', 64)
+    message_batcher.window = app.config.get('SOCKETIO_BATCH_WINDOW_MS', 40) / 1000
+    message_batcher.legacy_events = app.config.get('SOCKETIO_LEGACY_NEW_MESSAGE', True)
+    socketio.init_app(app, cors_allowed_origins='*', client_manager=manager)
+
+
+def stats():
+    """Profundidade das filas de emissão e contadores de descarte deste processo"""
+    manager = socketio.server.manager if socketio.server else None
+    return {
+        'batching': message_batcher.stats(),
+        'clients': manager.stats() if isinstance(manager, BufferedManager) else {}
+    }
+
+
+def emit_event(event, data, room):
+    """Emitir um evento sem deixar falhas do pub/sub derrubarem a requisição"""
+    try:
+        socketio.emit(event, data, room=room)
+    except Exception as e:
+        print(f'Erro ao emitir {event} para {room}: {str(e)}')
+
+
+def notify_new_message(conversation_id, message_data):
+    """Notificar nova mensagem via Socket.IO (agrupada em 'new_messages' por conversa)"""
+    message_batcher.add(conversation_id, message_data)
+
+
+def notify_conversation_transfer(conversation_id, transfer_data):
+    """Notificar transferência de conversa via Socket.IO"""
+    emit_event('conversation_transferred', {
+        'conversation_id': conversation_id,
+        'transfer': transfer_data
+    }, room=f'conversation_{conversation_id}')
+
+
+def notify_conversation_status(conversation_id, status):
+    """Notificar fechamento/reabertura de conversa via Socket.IO"""
+    emit_event('conversation_status', {
+        'conversation_id': conversation_id,
+        'status': status
+    }, room=f'conversation_{conversation_id}')
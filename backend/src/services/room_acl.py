@@ -0,0 +1,121 @@
+from collections import namedtuple
+
+from src.models.user import db, Conversation
+from src.services.cache import LRUCache
+from src.services.inbox import inbox_rooms
+from src.services.realtime import socketio
+
+# Dono da conversa: só o que as regras de acesso precisam
+ConversationOwner = namedtuple('ConversationOwner', ['department_id', 'assigned_agent_id'])
+
+# conversation_id -> ConversationOwner; transferências invalidam na hora, o TTL
+# limita a defasagem quando a alteração acontece em outro processo
+conversation_owner_cache = LRUCache(maxsize=50000, ttl=60)
+
+# Sessões Socket.IO autenticadas deste processo: sid -> Principal
+socket_principals = {}
+sids_by_user = {}
+
+
+def init_app(app):
+    conversation_owner_cache.maxsize = app.config.get('ROOM_ACL_CACHE_SIZE', 50000)
+    conversation_owner_cache.ttl = app.config.get('ROOM_ACL_TTL', 60)
+
+
+def can_access_conversation(user, conversation):
+    """Verificar se o usuário pode acessar a conversa"""
+    if user.role == 'admin':
+        return True
+    elif user.role == 'manager':
+        return user.department_id == conversation.department_id
+    elif user.role == 'agent':
+        return (user.id == conversation.assigned_agent_id or
+                user.department_id == conversation.department_id)
+    return False
+
+
+def attach_principal(sid, principal):
+    socket_principals[sid] = principal
+    sids_by_user.setdefault(principal.id, set()).add(sid)
+
+
+def socket_principal(sid):
+    return socket_principals.get(sid)
+
+
+def detach_principal(sid):
+    principal = socket_principals.pop(sid, None)
+    if principal is not None:
+        sids = sids_by_user.get(principal.id)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del sids_by_user[principal.id]
+
+
+def conversation_owner(conversation_id):
+    """Departamento e agente da conversa, do cache ou do banco; None se não existir"""
+    owner = conversation_owner_cache.get(conversation_id)
+    if owner is None:
+        row = db.session.query(
+            Conversation.department_id, Conversation.assigned_agent_id
+        ).filter(Conversation.id == conversation_id).first()
+        if row is None:
+            return None
+        owner = ConversationOwner(row.department_id, row.assigned_agent_id)
+        conversation_owner_cache.set(conversation_id, owner)
+    return owner
+
+
+def can_join_conversation(sid, conversation_id):
+    """Autorizar a entrada na sala pela sessão do socket; sem banco quando o dono está em cache"""
+    principal = socket_principals.get(sid)
+    return principal is not None and _allowed_now(principal, conversation_id)
+
+
+def invalidate_conversation_acl(conversation):
+    """Atualizar o dono em cache e tirar da sala os sockets locais que perderam acesso"""
+    owner = ConversationOwner(conversation.department_id, conversation.assigned_agent_id)
+    conversation_owner_cache.set(conversation.id, owner)
+    room = f'conversation_{conversation.id}'
+    for sid, _ in list(room_participants(room)):
+        principal = socket_principals.get(sid)
+        if principal is None or not can_access_conversation(principal, owner):
+            socketio.server.leave_room(sid, room)
+
+
+def _allowed_now(principal, conversation_id):
+    owner = conversation_owner(conversation_id)
+    return owner is not None and can_access_conversation(principal, owner)
+
+
+def refresh_user(user_id, principal):
+    """Aplicar alteração de usuário às conexões abertas dele neste processo
+
+    principal None (usuário removido ou inativo) desconecta os sockets; caso
+    contrário a sessão passa a usar o novo principal, sai das salas de
+    conversas que ele não pode mais ver e troca as salas da caixa de entrada.
+    """
+    for sid in list(sids_by_user.get(user_id, ())):
+        if principal is None or not principal.is_active:
+            detach_principal(sid)
+            socketio.server.disconnect(sid)
+            continue
+        previous = socket_principals[sid]
+        socket_principals[sid] = principal
+        rooms = set(socketio.server.rooms(sid))
+        for room in rooms:
+            if room.startswith('conversation_') and not _allowed_now(principal, int(room.split('_', 1)[1])):
+                socketio.server.leave_room(sid, room)
+        # Salas da caixa de entrada acompanham o departamento/papel
+        if set(inbox_rooms(previous)) & rooms:
+            for room in set(inbox_rooms(previous)) - set(inbox_rooms(principal)):
+                socketio.server.leave_room(sid, room)
+            for room in inbox_rooms(principal):
+                socketio.server.enter_room(sid, room)
+
+
+def room_participants(room, namespace='/'):
+    if socketio.server is None:
+        return []
+    return socketio.server.manager.get_participants(namespace, room)
@@ -0,0 +1,145 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow é opcional: sem ele só há prévias de PDF (via pdftoppm)
+    Image = None
+
+from src.services.blob_store import blob_store
+
+# Lado maior, em pixels, de cada tamanho de prévia
+PREVIEW_SIZES = {'thumb': 160, 'small': 480, 'large': 1280}
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+
+
+class ThumbnailPool:
+    """Geração em segundo plano de miniaturas e prévias otimizadas para a web
+
+    As prévias são JPEG progressivos em previews/aa/<sha256>-<tamanho>.jpg, de modo
+    que arquivos deduplicados compartilham as mesmas prévias. Imagens usam Pillow;
+    PDFs têm a primeira página rasterizada pelo pdftoppm (poppler-utils).
+    """
+
+    def __init__(self, app=None):
+        self.executor = None
+        self.root = os.path.join(blob_store.root, 'previews')
+        self.pending = set()
+        self.failed = set()
+        self.pdftoppm = None
+        self._lock = threading.Lock()
+        # Prévias saem junto com o último arquivo que usa o conteúdo
+        blob_store.on_collect.append(self.discard)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.quality = app.config.get('THUMBNAIL_QUALITY', 80)
+        self.timeout = app.config.get('THUMBNAIL_TIMEOUT', 30)
+        self.pdftoppm = shutil.which('pdftoppm')
+        self.executor = ThreadPoolExecutor(
+            max_workers=app.config.get('THUMBNAIL_WORKERS', 2), thread_name_prefix='thumbnails'
+        )
+        os.makedirs(self.root, exist_ok=True)
+        app.extensions['thumbnail_pool'] = self
+
+    def supports(self, file_path):
+        extension = file_path.rsplit('.', 1)[-1].lower()
+        if extension in IMAGE_EXTENSIONS:
+            return Image is not None
+        if extension == 'pdf':
+            return self.pdftoppm is not None
+        return False
+
+    def preview_path(self, sha256, size):
+        return os.path.join(self.root, sha256[:2], f'{sha256}-{size}.jpg')
+
+    def discard(self, sha256):
+        """Apagar as prévias de um conteúdo que deixou de existir"""
+        self.failed.discard(sha256)
+        for size in PREVIEW_SIZES:
+            try:
+                os.remove(self.preview_path(sha256, size))
+            except FileNotFoundError:
+                pass
+
+    def submit(self, sha256, file_path):
+        """Enfileirar a geração das prévias de um arquivo
+
+        Retorna False quando não haverá prévia (tipo sem suporte ou falha anterior).
+        """
+        if self.executor is None or not self.supports(file_path) or sha256 in self.failed:
+            return False
+        if all(os.path.exists(self.preview_path(sha256, size)) for size in PREVIEW_SIZES):
+            return True
+        with self._lock:
+            if sha256 in self.pending:
+                return True
+            self.pending.add(sha256)
+        self.executor.submit(self._run, sha256, file_path)
+        return True
+
+    def _run(self, sha256, file_path):
+        try:
+            source = os.path.join(blob_store.root, file_path)
+            if file_path.lower().endswith('.pdf'):
+                self._render_pdf(sha256, source)
+            else:
+                with Image.open(source) as image:
+                    self._write_previews(sha256, image)
+        except Exception as e:
+            print(f'Erro ao gerar prévia de {file_path}: {str(e)}')
+            self.failed.add(sha256)
+        finally:
+            with self._lock:
+                self.pending.discard(sha256)
+
+    def _render_pdf(self, sha256, source):
+        largest = max(PREVIEW_SIZES.values())
+        with tempfile.TemporaryDirectory(dir=blob_store.tmp_dir) as workdir:
+            prefix = os.path.join(workdir, 'page')
+            subprocess.run(
+                [self.pdftoppm, '-f', '1', '-l', '1', '-singlefile', '-scale-to', str(largest),
+                 '-jpeg', source, prefix],
+                check=True, capture_output=True, timeout=self.timeout
+            )
+            if Image is not None:
+                with Image.open(f'{prefix}.jpg') as image:
+                    self._write_previews(sha256, image)
+                return
+            # Sem Pillow: um pdftoppm por tamanho
+            for size, pixels in PREVIEW_SIZES.items():
+                subprocess.run(
+                    [self.pdftoppm, '-f', '1', '-l', '1', '-singlefile', '-scale-to', str(pixels),
+                     '-jpeg', source, prefix],
+                    check=True, capture_output=True, timeout=self.timeout
+                )
+                self._publish(f'{prefix}.jpg', self.preview_path(sha256, size))
+
+    def _write_previews(self, sha256, image):
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            # Transparência sobre fundo branco (JPEG não tem canal alfa)
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            image = image.convert('RGBA')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        # Do maior para o menor, reaproveitando a redução anterior
+        for size, pixels in sorted(PREVIEW_SIZES.items(), key=lambda item: -item[1]):
+            image = image.copy()
+            image.thumbnail((pixels, pixels))
+            fd, temp = tempfile.mkstemp(dir=blob_store.tmp_dir, suffix='.jpg')
+            with os.fdopen(fd, 'wb') as f:
+                image.save(f, 'JPEG', quality=self.quality, optimize=True, progressive=True)
+            self._publish(temp, self.preview_path(sha256, size))
+
+    def _publish(self, temp, destination):
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(temp, destination)
+
+
+thumbnail_pool = ThumbnailPool()
@@ -0,0 +1,215 @@
+import math
+import threading
+import time
+
+from src.services.realtime import socketio
+
+
+class TimerWheel:
+    """Roda de temporização: agendar e cancelar em O(1), avançar em O(itens vencidos)
+
+    Cada item fica no slot do seu tick absoluto (prazo / resolução); prazos além
+    de uma volta da roda dividem o slot com itens de voltas anteriores e só são
+    entregues quando o tick deles chega.
+    """
+
+    def __init__(self, resolution=0.25, slots=64):
+        self.resolution = resolution
+        self.slots = [dict() for _ in range(slots)]
+        self.last_tick = self.tick_for(time.monotonic())
+
+    def tick_for(self, deadline):
+        return math.ceil(deadline / self.resolution)
+
+    def schedule(self, key, deadline):
+        """Agendar a chave; retorna o tick usado, para descartar agendamentos antigos"""
+        tick = max(self.tick_for(deadline), self.last_tick + 1)
+        self.slots[tick % len(self.slots)][key] = tick
+        return tick
+
+    def advance(self, now):
+        """Retorna [(chave, tick)] vencidos até agora"""
+        due = []
+        current = self.tick_for(now)
+        # Depois de uma pausa longa basta percorrer cada slot uma vez
+        start = max(self.last_tick + 1, current - len(self.slots) + 1)
+        for tick in range(start, current + 1):
+            slot = self.slots[tick % len(self.slots)]
+            for key, key_tick in list(slot.items()):
+                if key_tick <= current:
+                    del slot[key]
+                    due.append((key, key_tick))
+        self.last_tick = max(self.last_tick, current)
+        return due
+
+
+class TypingState:
+    __slots__ = ('sid', 'room', 'payload', 'typing', 'emitted', 'emitted_at', 'expires_at', 'due_tick')
+
+    def __init__(self, sid, room, payload):
+        self.sid = sid
+        self.room = room
+        self.payload = payload
+        self.typing = False
+        self.emitted = False
+        self.emitted_at = 0.0
+        self.expires_at = 0.0
+        self.due_tick = None
+
+
+class TypingTracker:
+    """Estado de digitação por (conversa, id do usuário) mantido no servidor
+
+    Só transições (digitando <-> parado) são emitidas para a sala, no máximo uma
+    por intervalo para cada usuário; transições dentro do intervalo ficam
+    pendentes e se anulam se o estado voltar ao último emitido. Sem novos
+    eventos 'typing' durante o timeout o estado expira sozinho, sem depender
+    do 'stop_typing' do cliente.
+    """
+
+    def __init__(self, interval=1.0, timeout=6.0, resolution=0.25):
+        self.interval = interval
+        self.timeout = timeout
+        self.wheel = TimerWheel(resolution)
+        self.states = {}
+        self.keys_by_sid = {}
+        self.lock = threading.Lock()
+        self.ticker = None
+
+    def configure(self, interval, timeout, resolution):
+        self.interval = interval
+        self.timeout = timeout
+        self.wheel = TimerWheel(resolution)
+
+    def typing(self, sid, conversation_id, user_id, user_name):
+        # Chave pelo id: dois agentes com o mesmo nome não se confundem; o nome vai só no payload
+        key = (conversation_id, user_id)
+        now = time.monotonic()
+        with self.lock:
+            state = self.states.get(key)
+            if state is None:
+                state = TypingState(sid, f'conversation_{conversation_id}', {
+                    'conversation_id': conversation_id,
+                    'user_id': user_id,
+                    'user_name': user_name
+                })
+                self.states[key] = state
+            if state.sid != sid or key not in self.keys_by_sid.get(sid, ()):
+                self.keys_by_sid.setdefault(sid, set()).add(key)
+            state.sid = sid
+            state.typing = True
+            # Renovar o prazo não mexe na roda: o item é reagendado quando vencer
+            state.expires_at = now + self.timeout
+            emit = self._settle(key, state, now)
+        self._ensure_ticker()
+        self._emit(emit)
+
+    def stop_typing(self, sid, conversation_id, user_id):
+        key = (conversation_id, user_id)
+        now = time.monotonic()
+        with self.lock:
+            state = self.states.get(key)
+            if state is None:
+                return
+            state.typing = False
+            emit = self._settle(key, state, now)
+        self._emit(emit)
+
+    def disconnect(self, sid):
+        """Encerrar a digitação de todos os usuários do socket desconectado"""
+        now = time.monotonic()
+        emits = []
+        with self.lock:
+            for key in self.keys_by_sid.pop(sid, ()):
+                state = self.states.get(key)
+                if state is None or state.sid != sid:
+                    continue
+                state.typing = False
+                # A desconexão não espera o intervalo
+                state.emitted_at = 0.0
+                emits.append(self._settle(key, state, now))
+        for emit in emits:
+            self._emit(emit)
+
+    def advance(self, now=None):
+        """Processar prazos vencidos: expirações e transições pendentes"""
+        now = time.monotonic() if now is None else now
+        emits = []
+        with self.lock:
+            for key, tick in self.wheel.advance(now):
+                state = self.states.get(key)
+                if state is None or state.due_tick != tick:
+                    continue
+                state.due_tick = None
+                if state.typing and state.expires_at <= now:
+                    state.typing = False
+                emits.append(self._settle(key, state, now))
+        for emit in emits:
+            self._emit(emit)
+
+    def _settle(self, key, state, now):
+        """Decidir o que emitir agora e quando olhar a chave de novo (chamado com o lock)"""
+        emit = None
+        if state.typing != state.emitted:
+            if now - state.emitted_at >= self.interval:
+                state.emitted = state.typing
+                state.emitted_at = now
+                event = 'user_typing' if state.typing else 'user_stop_typing'
+                emit = (event, state.payload, state.room, state.sid)
+
+        deadlines = []
+        if state.typing:
+            deadlines.append(state.expires_at)
+        if state.typing != state.emitted:
+            deadlines.append(state.emitted_at + self.interval)
+
+        if deadlines:
+            deadline = min(deadlines)
+            if state.due_tick is None or self.wheel.tick_for(deadline) < state.due_tick:
+                state.due_tick = self.wheel.schedule(key, deadline)
+        elif not state.emitted:
+            # Parado e já anunciado: nada mais a acompanhar
+            self._forget(key, state)
+        return emit
+
+    def _forget(self, key, state):
+        del self.states[key]
+        keys = self.keys_by_sid.get(state.sid)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.keys_by_sid[state.sid]
+
+    def _emit(self, emit):
+        if emit is None:
+            return
+        event, payload, room, sid = emit
+        try:
+            socketio.emit(event, payload, to=room, skip_sid=sid)
+        except Exception as e:
+            print(f'Erro ao emitir {event} para {room}: {str(e)}')
+
+    def _ensure_ticker(self):
+        if self.ticker is None:
+            with self.lock:
+                if self.ticker is None:
+                    self.ticker = socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            socketio.sleep(self.wheel.resolution)
+            try:
+                self.advance()
+            except Exception as e:
+                print(f'Erro ao processar digitação: {str(e)}')
+
+
+typing_tracker = TypingTracker()
+
+
+def init_app(app):
+    typing_tracker.configure(
+        interval=app.config.get('TYPING_THROTTLE_INTERVAL', 1.0),
+        timeout=app.config.get('TYPING_TIMEOUT', 6.0),
+        resolution=app.config.get('TYPING_TICK', 0.25)
+    )
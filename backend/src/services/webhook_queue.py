@@ -0,0 +1,183 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from src.services.metrics import webhook_queue_latency
+
+
+class WebhookQueue:
+    """Fila durável (SQLite) para os payloads recebidos pelo webhook do WhatsApp.
+
+    O webhook apenas grava o payload bruto e responde 200; um pool de workers
+    drena a fila em segundo plano. Itens em processamento cujo prazo expirou
+    (processo morto no meio do trabalho) voltam a ser entregues automaticamente.
+    """
+
+    def __init__(self, app=None, handler=None):
+        self.app = None
+        self.handler = handler
+        self.path = None
+        self.concurrency = 0
+        self.visibility_timeout = 60
+        self.max_attempts = 5
+        self.poll_interval = 1.0
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._workers = []
+        if app is not None:
+            self.init_app(app, handler)
+
+    def init_app(self, app, handler=None):
+        self.app = app
+        if handler is not None:
+            self.handler = handler
+        self.path = app.config.get('WEBHOOK_QUEUE_PATH')
+        self.concurrency = app.config.get('WEBHOOK_QUEUE_WORKERS', 2)
+        self.visibility_timeout = app.config.get('WEBHOOK_QUEUE_VISIBILITY_TIMEOUT', 60)
+        self.max_attempts = app.config.get('WEBHOOK_QUEUE_MAX_ATTEMPTS', 5)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        conn = self._connection()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS webhook_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload BLOB NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                locked_until REAL,
+                last_error TEXT,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_webhook_queue_status_available
+                ON webhook_queue (status, available_at);
+        """)
+        app.extensions['webhook_queue'] = self
+
+    def _connection(self):
+        """Conexão SQLite própria de cada thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # FULL: o payload precisa estar no disco antes de responder 200 à Meta
+            conn.execute('PRAGMA synchronous=FULL')
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, payload):
+        """Gravar um payload bruto (bytes ou str) na fila"""
+        now = time.time()
+        cursor = self._connection().execute(
+            'INSERT INTO webhook_queue (payload, available_at, created_at) VALUES (?, ?, ?)',
+            (payload, now, now)
+        )
+        self._wakeup.set()
+        return cursor.lastrowid
+
+    def claim(self):
+        """Reservar o próximo item disponível; retorna (id, payload, attempts, created_at) ou None"""
+        now = time.time()
+        row = self._connection().execute("""
+            UPDATE webhook_queue
+               SET status = 'processing', attempts = attempts + 1, locked_until = ?
+             WHERE id = (
+                SELECT id FROM webhook_queue
+                 WHERE (status = 'pending' AND available_at <= ?)
+                    OR (status = 'processing' AND locked_until <= ?)
+                 ORDER BY id
+                 LIMIT 1
+             )
+            RETURNING id, payload, attempts, created_at
+        """, (now + self.visibility_timeout, now, now)).fetchone()
+        return row
+
+    def ack(self, item_id):
+        """Remover um item processado com sucesso"""
+        self._connection().execute('DELETE FROM webhook_queue WHERE id = ?', (item_id,))
+
+    def nack(self, item_id, attempts, error):
+        """Devolver um item à fila com backoff exponencial, ou descartá-lo após o limite"""
+        if attempts >= self.max_attempts:
+            self._connection().execute(
+                "UPDATE webhook_queue SET status = 'dead', locked_until = NULL, last_error = ? WHERE id = ?",
+                (error, item_id)
+            )
+        else:
+            self._connection().execute(
+                "UPDATE webhook_queue SET status = 'pending', locked_until = NULL, available_at = ?, last_error = ? WHERE id = ?",
+                (time.time() + min(2 ** attempts, 300), error, item_id)
+            )
+
+    def stats(self):
+        """Profundidade da fila por status e idade do item pendente mais antigo"""
+        counts = {'pending': 0, 'processing': 0, 'dead': 0}
+        oldest = None
+        for status, count, created_at in self._connection().execute(
+            'SELECT status, COUNT(*), MIN(created_at) FROM webhook_queue GROUP BY status'
+        ):
+            counts[status] = count
+            if status != 'dead' and created_at is not None:
+                oldest = created_at if oldest is None else min(oldest, created_at)
+        return {
+            'backlog': counts['pending'] + counts['processing'],
+            'pending': counts['pending'],
+            'processing': counts['processing'],
+            'dead': counts['dead'],
+            'oldest_age_seconds': round(time.time() - oldest, 3) if oldest else 0,
+            'workers': len([w for w in self._workers if w.is_alive()])
+        }
+
+    def process_next(self):
+        """Processar um único item; retorna False se a fila estiver vazia"""
+        item = self.claim()
+        if item is None:
+            return False
+
+        item_id, payload, attempts, created_at = item
+        try:
+            with self.app.app_context():
+                self.handler(json.loads(payload))
+            self.ack(item_id)
+            webhook_queue_latency.observe(time.time() - created_at)
+        except Exception as e:
+            print(f'Erro ao processar item {item_id} da fila do webhook: {str(e)}')
+            self.nack(item_id, attempts, str(e))
+        return True
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            try:
+                if not self.process_next():
+                    self._wakeup.wait(self.poll_interval)
+                    self._wakeup.clear()
+            except Exception as e:
+                print(f'Erro no worker da fila do webhook: {str(e)}')
+                self._stop.wait(self.poll_interval)
+
+    def start(self, concurrency=None):
+        """Iniciar o pool de workers que drena a fila"""
+        concurrency = self.concurrency if concurrency is None else concurrency
+        self._stop.clear()
+        for i in range(concurrency):
+            worker = threading.Thread(
+                target=self._worker_loop,
+                name=f'webhook-queue-worker-{len(self._workers) + 1}',
+                daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self, timeout=None):
+        """Parar os workers (itens em andamento são concluídos)"""
+        self._stop.set()
+        self._wakeup.set()
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+
+
+webhook_queue = WebhookQueue()
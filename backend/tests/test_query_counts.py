@@ -0,0 +1,90 @@
+"""O número de consultas das listagens não pode crescer com o número de linhas (N+1)
+
+Usa o cabeçalho Server-Timing de services/query_stats.py; com SQL_STRICT e
+SQL_QUERY_BUDGET a requisição que estourar o orçamento já responde 500.
+"""
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix='whats-tests-')
+
+os.environ.update({
+    'DATABASE_URL': f"sqlite:///{os.path.join(WORKDIR, 'app.db')}",
+    'WEBHOOK_QUEUE_PATH': os.path.join(WORKDIR, 'webhook_queue.db'),
+    'WEBHOOK_QUEUE_WORKERS': '0',
+    'UPLOAD_FOLDER': os.path.join(WORKDIR, 'uploads'),
+    'RATELIMIT_ENABLED': '0',
+    'SQL_QUERY_BUDGET': '20',
+    'SQL_STRICT': '1',
+})
+sys.path.insert(0, BACKEND_DIR)
+
+from src.main import app  # noqa: E402
+from src.models.user import db, Conversation, Department, Message, User  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def client():
+    with app.test_client() as client:
+        response = client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+        client.environ_base['HTTP_AUTHORIZATION'] = f"Bearer {response.get_json()['token']}"
+        yield client
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+def seed(conversations, messages_per_conversation):
+    """Criar conversas em departamentos e com agentes distintos; retorna os ids"""
+    with app.app_context():
+        offset = Conversation.query.count()
+        ids = []
+        for i in range(offset, offset + conversations):
+            department = Department(name=f'Departamento {i}')
+            agent = User(username=f'agente{i}', name=f'Agente {i}', email=f'agente{i}@exemplo.com',
+                         role='agent', department=department)
+            agent.set_password('senha123')
+            conversation = Conversation(whatsapp_contact_id=f'5511{i:08d}', contact_name=f'Contato {i}',
+                                        department=department, assigned_agent=agent)
+            db.session.add(conversation)
+            db.session.flush()
+            db.session.add_all(
+                Message(conversation_id=conversation.id, sender_type='agent' if n % 2 else 'customer',
+                        sender_id=agent.id if n % 2 else None, content=f'Mensagem {n}')
+                for n in range(messages_per_conversation)
+            )
+            ids.append(conversation.id)
+        db.session.commit()
+        return ids
+
+
+def query_count(client, url):
+    # A primeira requisição depois do seed recarrega o usuário do token (cache de principal)
+    client.get(url)
+    response = client.get(url)
+    assert response.status_code == 200, response.get_json()
+    match = re.search(r'desc="(\d+) queries"', response.headers.get('Server-Timing', ''))
+    assert match, 'Server-Timing sem a contagem de consultas'
+    return int(match.group(1))
+
+
+def test_conversation_list_and_history_use_constant_queries(client):
+    few = seed(conversations=2, messages_per_conversation=2)[-1]
+    small = {
+        'list': query_count(client, '/api/conversations?per_page=100'),
+        'detail': query_count(client, f'/api/conversations/{few}'),
+        'messages': query_count(client, f'/api/conversations/{few}/messages?limit=100'),
+    }
+
+    many = seed(conversations=40, messages_per_conversation=60)[-1]
+    large = {
+        'list': query_count(client, '/api/conversations?per_page=100'),
+        'detail': query_count(client, f'/api/conversations/{many}'),
+        'messages': query_count(client, f'/api/conversations/{many}/messages?limit=100'),
+    }
+
+    assert large == small
@@ -51,14 +51,22 @@ const ChatInterface = () => {
         console.log('Conectado ao servidor Socket.IO');
       });
 
-      newSocket.on('new_message', (data) => {
+      newSocket.on('new_messages', (data) => {
         if (selectedConversation && data.conversation_id === selectedConversation.id) {
-          setMessages(prev => [...prev, data.message]);
+          setMessages(prev => [...prev, ...data.messages]);
         }
         // Atualizar lista de conversas
         fetchConversations();
       });
 
+      // Eventos descartados por conexão lenta: recarregar o estado pela API
+      newSocket.on('resync', () => {
+        if (selectedConversation) {
+          fetchConversationDetails(selectedConversation.id);
+        }
+        fetchConversations();
+      });
+
       newSocket.on('conversation_transferred', (data) => {
         if (selectedConversation && data.conversation_id === selectedConversation.id) {
           fetchConversationDetails(selectedConversation.id);